@@ -0,0 +1,114 @@
+/*
+ * Clientside callbacks of the binding energy dashboard.
+ *
+ * The atom data is kept in the browser (store-bindener) with energies in Hartree, so unit
+ * changes, method selection and the Fermi energy line are computed here without calling
+ * the server. Conversion factors and unit labels come from store-units.
+ */
+
+// tick values of a log axis covering [vmin, vmax], as in structure_data.log_minor_and_major_ticks
+function logMinorAndMajorTicks(vmin, vmax) {
+    let imin = Math.round(Math.log10(vmin));
+    imin = Math.pow(10, imin) < vmin ? imin : imin - 1;
+    let imax = Math.round(Math.log10(vmax));
+    imax = Math.pow(10, imax) > vmax ? imax : imax + 1;
+
+    const tickvals = [];
+    const ticktext = [];
+    for (let i = imin; i <= imax; i++) {
+        for (let k = 1; k < 10; k++) {
+            tickvals.push(k * Math.pow(10, i));
+            ticktext.push(k === 1 ? '1e' + (i < 0 ? '-' : '+') + String(Math.abs(i)).padStart(2, '0') : '');
+        }
+    }
+    return [tickvals, ticktext];
+}
+
+// Wigner-Seitz radius (a.u.) and Fermi energy (Hartree), as in miscellaneous.fermi_gas_parameters
+function fermiGasParameters(ne, density, mass) {
+    const C = 0.5 * Math.pow(9 * Math.PI / 4, 2 / 3);
+    const atomicDensity = 8.916E-2 * ne * density / mass;
+    const rs = Math.pow(3 / (4 * Math.PI * atomicDensity), 1 / 3);
+    return [rs, C / (rs * rs)];
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    bindener: {
+
+        // energies in the units selected, Fermi line and log ticks
+        render_energies: function (units, nFEG, data, unitsData, figure) {
+            if (!data || !figure || !figure.data) {
+                return window.dash_clientside.no_update;
+            }
+            const conv = unitsData.units_per_hartree[units];
+            const unitsShort = unitsData.units_short[units];
+            const nMethods = data.methods.length;
+            const fig = Object.assign({}, figure);
+            fig.data = figure.data.slice();
+
+            let vmin = Infinity;
+            let vmax = -Infinity;
+            data.methods.forEach(function (method, i) {
+                const y = data.energies[method].map(function (e) { return e === null ? null : e * conv; });
+                y.forEach(function (e) {
+                    if (e !== null && e > 0) { vmin = Math.min(vmin, e); vmax = Math.max(vmax, e); }
+                });
+                fig.data[i] = Object.assign({}, figure.data[i], { y: y, hovertemplate: '%{y:.3f} ' + unitsShort });
+            });
+
+            if (fig.data.length > nMethods) {
+                const fermi = Object.assign({}, figure.data[nMethods], { visible: nFEG > 0, hovertemplate: '%{y:.3f} ' + unitsShort });
+                if (nFEG > 0) {
+                    const Ef = fermiGasParameters(nFEG, data.density, data.mass)[1] * conv;
+                    fermi.y = [Ef, Ef];
+                }
+                fig.data[nMethods] = fermi;
+            }
+
+            const ticks = logMinorAndMajorTicks(vmin, vmax);
+            const yaxis = Object.assign({}, figure.layout.yaxis, { tickvals: ticks[0], ticktext: ticks[1] });
+            yaxis.title = Object.assign({}, yaxis.title, { text: 'Binding energies (' + unitsShort + ')' });
+            fig.layout = Object.assign({}, figure.layout, { yaxis: yaxis });
+            return fig;
+        },
+
+        // wigner-seitz radius and fermi energy shown in the sidebar
+        fermi_parameters: function (nFEG, units, data, unitsData) {
+            if (!data || nFEG === null || nFEG === undefined || nFEG <= 0) {
+                return ['', ''];
+            }
+            const params = fermiGasParameters(nFEG, data.density, data.mass);
+            const Ef = params[1] * unitsData.units_per_hartree[units];
+            return [params[0].toFixed(2) + ' a.u.', Ef.toFixed(2) + ' ' + unitsData.units_short[units]];
+        },
+
+        // link of the streamed export of all the elements
+        export_link: function (units, format) {
+            return '/api/export?units=' + encodeURIComponent(units) + '&format=' + encodeURIComponent(format);
+        },
+
+        // methods selected that were not requested with the atom data, loaded by the server
+        missing_methods: function (methods, data) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            const requested = data.requested || data.methods;
+            const missing = (methods || []).filter(function (method) { return requested.indexOf(method) < 0; });
+            return missing.length ? missing : window.dash_clientside.no_update;
+        },
+
+        // show only the methods selected
+        visible_methods: function (methods, data, figure) {
+            if (!data || !figure || !figure.data) {
+                return window.dash_clientside.no_update;
+            }
+            const selected = methods || [];
+            const fig = Object.assign({}, figure);
+            fig.data = figure.data.map(function (trace, i) {
+                if (i >= data.methods.length) { return trace; }
+                return Object.assign({}, trace, { visible: selected.indexOf(data.methods[i]) >= 0 });
+            });
+            return fig;
+        }
+    }
+});
@@ -0,0 +1,57 @@
+"""
+
+Times the construction of the binding energies figure for every element with data
+
+    python -m benchmarks.bench_figure [--budget MS] [--repeat N]
+
+Exits with status 1 if the median time per atom is above the budget (ms).
+
+"""
+import sys
+import time
+import argparse
+import numpy as np
+import src.data_store as store
+import src.structure_data as struc
+
+
+def time_figures(atoms, units='eV', repeat=5):
+    '''
+    Best time (ms) out of repeat builds of the figure dictionary of each atom
+    '''
+    timings = dict()
+    for atom in atoms:
+        bindener = struc.get_binding_energies(atom, units)
+        best = np.inf
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            bindener.binding_energies_figure()
+            best = min(best, time.perf_counter() - t0)
+        timings[atom] = 1e3 * best
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=3.0, help='maximum median time per atom (ms)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--units', default='eV')
+    args = parser.parse_args(argv)
+
+    data_store = store.get_store()
+    atoms = list(data_store.energies['experimental'].keys())
+    struc.figure_template()
+    timings = time_figures(atoms, units=args.units, repeat=args.repeat)
+
+    values = np.array(list(timings.values()))
+    slowest = max(timings, key=timings.get)
+    print(f'binding_energies_figure: {len(values)} atoms, median {np.median(values):.3f} ms, '
+          f'max {values.max():.3f} ms ({slowest})')
+    if np.median(values) > args.budget:
+        print(f'median above the budget of {args.budget} ms')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+
+Cold start of the app: time to import its dependencies, load the data and build the app,
+measured in fresh interpreters
+
+    python -m benchmarks.bench_startup [--budget S] [--repeat N] [--importtime N]
+
+Each stage counts only what was not loaded by the previous ones. Exits with status 1 if
+the best total time (s) is above the budget (BINDENER_STARTUP_BUDGET, 3 s by default).
+--importtime N also prints the N slowest modules reported by python -X importtime.
+
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imports in the order of bindener_app, then the data loads of bindener_app.preload_data
+IMPORT_STAGES = ['numpy', 'pandas', 'flask', 'dash', 'dash_bootstrap_components', 'src.miscellaneous',
+                 'src.data_store', 'src.structure_data', 'src.wavefunctions', 'src.error_engine', 'src.rest_api']
+LOAD_STAGES = ['data store', 'expectation values', 'error engine', 'figure template']
+
+
+def measure_stages():
+    '''
+    Runs the stages in this interpreter, returning {stage: seconds}
+    '''
+    import importlib
+    timings = dict()
+
+    def timed(stage, func):
+        t0 = time.perf_counter()
+        func()
+        timings[stage] = time.perf_counter() - t0
+
+    for module in IMPORT_STAGES:
+        timed(f'import {module}', lambda: importlib.import_module(module))
+
+    import src.data_store as store
+    import src.wavefunctions as wave
+    import src.error_engine as errors
+    import src.structure_data as struc
+    loads = [store.get_store, lambda: wave.get_wavefunctions().expectation_values(),
+             errors.get_error_engine, struc.figure_template]
+    for stage, func in zip(LOAD_STAGES, loads):
+        timed(f'load {stage}', func)
+
+    timed('import bindener_app', lambda: importlib.import_module('bindener_app'))
+    return timings
+
+
+def cold_start():
+    '''
+    Stages and total time (including the interpreter start) of a fresh interpreter
+    '''
+    t0 = time.perf_counter()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - t0
+    return json.loads(output.splitlines()[-1]), total
+
+
+def slowest_imports(n):
+    '''
+    The n modules with the largest cumulative import time (s) of bindener_app
+    '''
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bindener_app'],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: self [us] | cumulative | imported package
+        _, cumulative_us, name = line.split(':', 1)[1].split('|')
+        modules.append((int(cumulative_us) * 1e-6, name.strip()))
+    return sorted(modules, reverse=True)[:n]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=float(os.environ.get('BINDENER_STARTUP_BUDGET', 3.0)),
+                        help='maximum cold start time (s)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--importtime', type=int, default=0, help='number of slowest modules to list')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_stages()))
+        return 0
+
+    runs = [cold_start() for _ in range(args.repeat)]
+    stages, total = min(runs, key=lambda run: run[1])
+    width = max(len(stage) for stage in stages)
+    for stage, seconds in stages.items():
+        print(f'{stage:<{width}}  {1e3 * seconds:8.1f} ms')
+    interpreter = total - sum(stages.values())
+    print(f'{"interpreter and other":<{width}}  {1e3 * interpreter:8.1f} ms')
+    print(f'cold start: {total:.2f} s (best of {args.repeat}), budget {args.budget:.2f} s')
+
+    if args.importtime:
+        print(f'\nslowest imports:')
+        for seconds, name in slowest_imports(args.importtime):
+            print(f'{name:<{width}}  {1e3 * seconds:8.1f} ms')
+
+    if total > args.budget:
+        print('cold start above the budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
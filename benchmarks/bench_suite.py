@@ -0,0 +1,229 @@
+"""
+
+Benchmark suite: times each stage from the source files to the dashboard callback on the
+real data and on synthetic data folders of growing size (see synthetic_data.py)
+
+    python -m benchmarks.bench_suite [--no-synthetic] [--repeat N] [--output results.json]
+    python -m benchmarks.bench_suite --save-baseline
+
+Stages:
+    experimental_load  experimentalData.load_database from the raw table
+    theoretical_load   theoreticalData.load_database of every theoretical folder
+    store_load         bindenerStore from the compiled bundles
+    assembly           bindingEnergies of every element
+    figure             binding_energies_graph of every element
+    update_methods     update_methods callback of the app for every element (no caches)
+
+Results are compared with the baseline (benchmarks/baseline.json): the run fails (status 1)
+if the total time of a stage is above its baseline by more than the threshold of the stage
+(a fraction, e.g. 0.5 for +50%). Baselines depend on the machine, so they should be saved
+again with --save-baseline on the machine running the comparisons.
+
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_THRESHOLD = 0.5
+
+# synthetic datasets: (elements, orbitals, methods)
+SYNTHETIC_SCALES = [(10, 29, 4), (40, 29, 4), (118, 29, 4), (92, 8, 4), (92, 52, 4), (92, 29, 1), (92, 29, 2)]
+
+# the callback cache of the app is disabled, update_methods is timed end to end
+os.environ.setdefault('BINDENER_CALLBACK_CACHE', '')
+
+import src.data_store as store
+import src.experimental_enerdata as expapp
+import src.theoretical_enerdata as theoapp
+import src.structure_data as struc
+
+
+def copy_sources(datafolder, root):
+    '''
+    Copies the source files of datafolder into root/data (the benchmarks rewrite them)
+    '''
+    for data_folder, patterns in store.SOURCE_PATTERNS.items():
+        for pattern in patterns:
+            for fpath in glob.glob(os.path.join(datafolder, data_folder, pattern)):
+                target = os.path.join(root, 'data', os.path.relpath(fpath, datafolder))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(fpath, target)
+    return os.path.join(root, 'data')
+
+
+def best_time(func, repeat, setup=None):
+    best = np.inf
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return {'total_ms': 1e3 * best}
+
+
+def per_element(func, elements):
+    '''
+    Times func(element) for every element: total, median and 95th percentile (ms)
+    '''
+    times = []
+    for element in elements:
+        t0 = time.perf_counter()
+        func(element)
+        times.append(time.perf_counter() - t0)
+    times = 1e3 * np.array(times)
+    return {'total_ms': times.sum(), 'median_ms': np.median(times), 'p95_ms': np.percentile(times, 95), 'n': len(times)}
+
+
+def run_stages(datafolder, repeat=3):
+    '''
+    Times every stage on datafolder (a copy that can be modified). Returns {stage: metrics}.
+    '''
+    results = dict()
+    expfolder = os.path.join(datafolder, 'experimental')
+    if os.path.isdir(expfolder):
+        def remove_processed():
+            for key in ['dat', 'ref']:
+                fpath = os.path.join(expfolder, f'ElectronBindingEnergies_{key}.tsv')
+                if os.path.isfile(fpath):
+                    os.remove(fpath)
+        results['experimental_load'] = best_time(lambda: expapp.experimentalData(expfolder, 'eV'), repeat, remove_processed)
+
+    theo_folders = [os.path.join(datafolder, folder) for folder in store.DATA_FOLDERS[1:]
+                    if os.path.isdir(os.path.join(datafolder, folder))]
+    if theo_folders:
+        results['theoretical_load'] = best_time(lambda: [theoapp.theoreticalData(folder, 'Hartree') for folder in theo_folders], repeat)
+
+    store.bindenerStore(datafolder)  # writes the bundle
+    results['store_load'] = best_time(lambda: store.bindenerStore(datafolder), repeat)
+
+    data_store = store.get_store(datafolder)
+    elements = list(data_store.table.drop_duplicates('Z')['element'])
+    assembled = dict()
+
+    def assemble(element):
+        assembled[element] = struc.bindingEnergies(element, 'Hartree', datafolder, data_store)
+    results['assembly'] = per_element(assemble, elements)
+    results['figure'] = per_element(lambda element: assembled[element].binding_energies_graph(), elements)
+
+    # the app reads ./data/ from the working directory
+    cwd = os.getcwd()
+    import bindener_app
+    try:
+        os.chdir(os.path.dirname(datafolder))
+        store.get_store('./data/')
+
+        def update_methods(element):
+            struc.bindener_cache.clear()
+            bindener_app.update_methods(element, None)
+        results['update_methods'] = per_element(update_methods, elements)
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def run_suite(synthetic=True, repeat=3):
+    '''
+    Results of every dataset: {dataset: {stage: metrics}}
+    '''
+    import benchmarks.synthetic_data as synthetic_data
+    datasets = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, 'data-real')
+        datasets['data'] = run_stages(copy_sources(os.path.join(ROOT, 'data'), root), repeat)
+        if synthetic:
+            for n_elements, n_orbitals, n_methods in SYNTHETIC_SCALES:
+                name = f'synthetic-e{n_elements}-o{n_orbitals}-m{n_methods}'
+                datafolder = synthetic_data.generate_data_folder(os.path.join(tmpdir, name), n_elements, n_orbitals, n_methods)
+                datasets[name] = run_stages(datafolder, repeat)
+    return datasets
+
+
+def compare(results, baseline):
+    '''
+    Stages slower than their baseline by more than their threshold, as a list of messages
+    '''
+    thresholds = baseline.get('thresholds', dict())
+    regressions = []
+    for dataset, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get('results', dict()).get(dataset, dict()).get(stage)
+            if reference is None:
+                continue
+            threshold = thresholds.get(stage, thresholds.get('default', DEFAULT_THRESHOLD))
+            limit = reference['total_ms'] * (1 + threshold)
+            if metrics['total_ms'] > limit:
+                regressions.append(f'{dataset} {stage}: {metrics["total_ms"]:.1f} ms > {limit:.1f} ms '
+                                   f'(baseline {reference["total_ms"]:.1f} ms +{100 * threshold:.0f}%)')
+    return regressions
+
+
+def print_results(results):
+    print(f'{"dataset":<26} {"stage":<18} {"total ms":>10} {"median ms":>10} {"p95 ms":>10}')
+    for dataset, stages in results.items():
+        for stage, metrics in stages.items():
+            median = f'{metrics["median_ms"]:10.3f}' if 'median_ms' in metrics else ' ' * 10
+            p95 = f'{metrics["p95_ms"]:10.3f}' if 'p95_ms' in metrics else ' ' * 10
+            print(f'{dataset:<26} {stage:<18} {metrics["total_ms"]:10.1f} {median} {p95}')
+
+
+def as_json(value):
+    if isinstance(value, dict):
+        return {key: as_json(val) for key, val in value.items()}
+    return round(float(value), 4) if isinstance(value, (float, np.floating)) else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-synthetic', action='store_true', help='only time the real data')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the load stages (best is kept)')
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=None, help='threshold of every stage (overrides the baseline)')
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    results = as_json(run_suite(synthetic=not args.no_synthetic, repeat=args.repeat))
+    print_results(results)
+    report = {'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.save_baseline:
+        thresholds = {'default': DEFAULT_THRESHOLD}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                thresholds = json.load(f).get('thresholds', thresholds)
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(report, thresholds=thresholds), f, indent=1)
+        print(f'baseline saved in {args.baseline}')
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(f'no baseline found in {args.baseline}')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.threshold is not None:
+        baseline['thresholds'] = {'default': args.threshold}
+    regressions = compare(results, baseline)
+    for message in regressions:
+        print('regression:', message)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
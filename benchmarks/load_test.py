@@ -0,0 +1,109 @@
+"""
+
+Load test of a running server: every simulated user selects atoms one after the other,
+each selection making the two requests of the browser (store data, then figure)
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+    python -m benchmarks.load_test --url http://127.0.0.1:8050 --users 32 --sessions 20
+
+Prints the throughput and latency percentiles. Exits with status 1 if any request fails
+or if the 95th percentile is above --budget (ms).
+
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+ATOMS = ['H', 'C', 'O', 'Fe', 'Cu', 'Ag', 'W', 'Pt', 'Au', 'Pb', 'Bi', 'U']
+
+
+def post_callback(url, payload):
+    request = urllib.request.Request(
+        url + '/_dash-update-component',
+        data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def select_atom(url, atom, units='eV'):
+    '''
+    Requests of the dashboard when an atom is selected: update_methods and draw_bindener.
+    Returns the latency (s) of each request.
+    '''
+    latencies = []
+    t0 = time.perf_counter()
+    outputs = post_callback(url, {
+        'output': '..store-bindener.data...dropdown-methods.options...dropdown-methods.value...feg-params.max..',
+        'outputs': [
+            {'id': 'store-bindener', 'property': 'data'},
+            {'id': 'dropdown-methods', 'property': 'options'},
+            {'id': 'dropdown-methods', 'property': 'value'},
+            {'id': 'feg-params', 'property': 'max'}],
+        'inputs': [{'id': 'input-atoms', 'property': 'value', 'value': atom}],
+        'state': [{'id': 'dropdown-methods', 'property': 'value', 'value': None}],
+        'changedPropIds': ['input-atoms.value']})
+    latencies.append(time.perf_counter() - t0)
+
+    response = outputs['response']
+    data = response['store-bindener']['data']
+    methods = response['dropdown-methods']['value']
+    t0 = time.perf_counter()
+    post_callback(url, {
+        'output': 'output-bindener.figure',
+        'outputs': {'id': 'output-bindener', 'property': 'figure'},
+        'inputs': [{'id': 'store-bindener', 'property': 'data', 'value': data}],
+        'state': [
+            {'id': 'input-units', 'property': 'value', 'value': units},
+            {'id': 'dropdown-methods', 'property': 'value', 'value': methods},
+            {'id': 'feg-params', 'property': 'value', 'value': 0}],
+        'changedPropIds': ['store-bindener.data']})
+    latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def user_session(url, sessions, seed):
+    rng = random.Random(seed)
+    latencies, failures = [], 0
+    for _ in range(sessions):
+        try:
+            latencies += select_atom(url, rng.choice(ATOMS), rng.choice(['Hartree', 'Rydberg', 'eV']))
+        except Exception:
+            failures += 1
+    return latencies, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--users', type=int, default=16, help='concurrent users')
+    parser.add_argument('--sessions', type=int, default=20, help='atoms selected by each user')
+    parser.add_argument('--budget', type=float, default=None, help='maximum 95th percentile latency (ms)')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        results = list(pool.map(lambda seed: user_session(args.url, args.sessions, seed), range(args.users)))
+    elapsed = time.perf_counter() - t0
+
+    latencies = 1e3 * np.array([t for user, _ in results for t in user])
+    failures = sum(f for _, f in results)
+    if len(latencies) == 0:
+        print(f'no request succeeded ({failures} failures)')
+        return 1
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f'{len(latencies)} requests in {elapsed:.1f} s ({len(latencies) / elapsed:.1f} req/s), {failures} failed sessions')
+    print(f'latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {latencies.max():.1f} ms')
+    if failures or (args.budget is not None and p95 > args.budget):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+
+Generator of synthetic data folders with the layout of ./data/, to measure how load,
+assembly and figure times scale with the number of elements, orbitals and methods
+
+    python -m benchmarks.synthetic_data <root> [--elements N] [--orbitals N] [--methods N]
+
+writes <root>/data/. Energies are hydrogen-like with some noise; experimental values carry
+random reference flags and gaps, as in the compilation of Williams.
+
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import src.miscellaneous as misc
+import src.orbital_index as orbidx
+import src.data_store as store
+import src.method_registry as registry
+
+
+def synthetic_energies(numbers, codes, rng):
+    '''
+    Hartree energies of orbitals (nlj codes) of elements with atomic numbers numbers, as
+    an (elements x orbitals) array: 0.5 (Z - screening)^2 / n^2, with 5% noise
+    '''
+    n = orbidx.ORBITALS['n'].to_numpy()[codes]
+    screening = 1.5 * np.arange(len(codes))
+    z_eff = np.maximum(numbers[:, None] - screening[None, :], 1.0)
+    energies = 0.5 * z_eff ** 2 / n[None, :] ** 2
+    return energies * rng.normal(1.0, 0.05, energies.shape)
+
+
+def experimental_cells(energies_eV, rng):
+    '''
+    Raw cells of the experimental table: values in eV with one decimal, reference flags
+    ('*', '+', 'a', 'b') and some gaps
+    '''
+    values = np.char.mod('%.1f', energies_eV).astype(object)
+    flags = rng.choice(['', '', '', '', '*', '+', '+a', '*b'], size=energies_eV.shape)
+    cells = values + flags.astype(object)
+    cells[rng.random(energies_eV.shape) < 0.05] = np.nan
+    return cells
+
+
+def generate_data_folder(root, n_elements=92, n_orbitals=29, n_methods=4, seed=0):
+    '''
+    Writes root/data with n_elements (the lightest ones, at most the 118 of the periodic
+    table), the first n_orbitals nlj orbitals in canonical order and the first n_methods
+    data folders of store.DATA_FOLDERS. Returns the path of the data folder.
+    '''
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(1, min(n_elements, misc.ELEMENTS.zmax) + 1)
+    symbols = list(misc.ELEMENTS.symbols[numbers])
+    codes = np.arange(min(n_orbitals, len(orbidx.LABELS)))
+    labels = list(orbidx.orbital_labels(codes))
+    energies = synthetic_energies(numbers.astype(np.float64), codes, rng)
+
+    datafolder = os.path.join(root, 'data')
+    for data_folder in store.DATA_FOLDERS[:n_methods]:
+        path = os.path.join(datafolder, data_folder)
+        os.makedirs(path, exist_ok=True)
+        noisy = energies * rng.normal(1.0, 0.02, energies.shape)
+
+        if data_folder == 'experimental':
+            cells = experimental_cells(noisy * misc.HARTREE_TO_EV, rng)
+            table = pd.DataFrame(cells, columns=labels)
+            table.insert(0, 'Element', symbols)
+            table.index = pd.Index(numbers, name='Z')
+            table.to_csv(os.path.join(path, 'ElectronBindingEnergies.tsv'), sep='\t')
+
+        elif data_folder == 'dirac-fock':
+            table = pd.DataFrame(np.round(noisy, 4), index=symbols, columns=labels)
+            table.to_csv(os.path.join(path, 'ElectronBindingEnergies.tsv'), sep='\t')
+
+        else:
+            relativistic = registry.METHODS[data_folder].orbitals == 'nlj'
+            for symbol, row in zip(symbols, noisy):
+                ener = pd.Series(np.round(row, 4), index=pd.Index(labels, name='Orb'), name='Energy(Hartree)')
+                if not relativistic:
+                    # non-relativistic methods give one value per nl orbital
+                    ener = ener.groupby(orbidx.ORBITALS['nl'].to_numpy()[codes], sort=False).mean().round(4)
+                    ener.index.name = 'Orb'
+                os.makedirs(os.path.join(path, symbol), exist_ok=True)
+                ener.to_csv(os.path.join(path, symbol, 'bindener.dat'), sep='\t')
+    return datafolder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    parser.add_argument('--elements', type=int, default=92)
+    parser.add_argument('--orbitals', type=int, default=29)
+    parser.add_argument('--methods', type=int, default=len(store.DATA_FOLDERS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    datafolder = generate_data_folder(args.root, args.elements, args.orbitals, args.methods, args.seed)
+    print(f'synthetic data written in {datafolder}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,24 @@
 
+import os
 import dash
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
-import periodictable
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import src.structure_data as struc
+import src.data_store as store
+import src.wavefunctions as wave
+import src.error_engine as errors
 import src.miscellaneous as misc
+import src.caching as caching
+import src.rest_api as api
+import src.export_data as export
+import src.metrics as metrics
+import src.method_registry as registry
 from src.app_styling import *
 
 
-atoms = {el.symbol: el.number for i, el in enumerate(periodictable.elements) if i > 0}
+atoms = misc.ELEMENTS.symbol_numbers
 atoms_options = [
     {
         'label': symbol + f'({number})',
@@ -19,7 +27,57 @@ atoms_options = [
     for symbol, number in atoms.items()
 ]
 
-app = dash.Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
+
+def preload_data(datafolder='./data/'):
+    '''
+    Loads every database and cache shared by the callbacks. Called at import, so that a 
+    pre-fork server (see wsgi.py) builds them once and its workers share them.
+    '''
+    data_store = store.get_store(datafolder)
+    wave.get_wavefunctions(datafolder).expectation_values()
+    errors.get_error_engine(datafolder)
+    struc.figure_template()
+    return data_store
+
+
+bindener_store = preload_data()
+
+
+def data_version():
+    bindener_store.refresh_if_stale()
+    return bindener_store.data_version
+
+
+# results of the callbacks on disk, shared by the server workers and kept across restarts
+# (BINDENER_CALLBACK_CACHE='' disables it)
+callback_cache_path = os.environ.get('BINDENER_CALLBACK_CACHE', os.path.join(bindener_store.main_folder, '.callbacks.sqlite'))
+callback_cache = caching.diskCache(
+    callback_cache_path,
+    max_bytes=int(os.environ.get('BINDENER_CALLBACK_CACHE_MB', 256)) * 2**20) if callback_cache_path else None
+
+
+def store_memory():
+    usage = {(('part', part), ): nbytes for part, nbytes in bindener_store.memory_usage().items()}
+    usage[(('part', 'error_cube'), )] = errors.get_error_engine(bindener_store.main_folder).memory_usage()
+    return usage
+
+
+def register_metrics(server):
+    '''
+    Adds the /metrics route with the caches and the memory of the store
+    '''
+    metrics.register_cache('bindener', struc.bindener_cache.info)
+    metrics.register_cache('api_responses', api.responses_cache.info)
+    metrics.register_cache('wave_traces', wave.get_wavefunctions(bindener_store.main_folder).traces.info)
+    if callback_cache is not None:
+        metrics.register_cache('callbacks', callback_cache.info)
+    metrics.register_cache('log_ticks', lambda: caching.lru_cache_info(struc.decade_ticks))
+    metrics.register_gauge('bindener_store_bytes', 'Memory held by the data store.', store_memory)
+    return metrics.register(server)
+
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+server = register_metrics(api.register(app.server))
 
 atoms_dropdown = dbc.Card(
     [
@@ -73,6 +131,11 @@ units_items = dbc.Card(
     }
 )
 
+units_data = {
+    'units_per_hartree': misc.ENERGY_UNITS_PER_HARTREE,
+    'units_short': {units: misc.shorten_units(units) for units in misc.ENERGY_UNITS_PER_HARTREE}
+}
+
 feg_input = dbc.Card(
     [
         html.Label('Electrons in FEG: '),
@@ -128,11 +191,36 @@ download_fig = html.Div(
     ],
 )
 
+export_formats = dbc.RadioItems(
+    id='input-export-format',
+    options=[
+        {
+            'label': 'CSV',
+            'value': 'csv'
+        },
+        {
+            'label': 'JSON',
+            'value': 'json'
+        },
+        {
+            'label': 'Parquet',
+            'value': 'parquet',
+            'disabled': not export.parquet_available()
+        }
+    ],
+    value='csv',
+    inline=True
+)
+
 download_csv = html.Div(
     [
         dbc.Button("Download Data", id="btn_data", className="me-md-2"),
         # html.Button("Download Data", id="btn_data"),
-        dcc.Download(id="download-data")
+        dcc.Download(id="download-data"),
+        # streamed by the server (see src/rest_api.py), the link follows the units and format
+        dbc.Button("All elements", id="btn_data_all", href='/api/export', external_link=True, download='', 
+                   outline=True, className="me-md-2"),
+        export_formats
     ],
 )
 
@@ -144,12 +232,99 @@ download_buttons = html.Div(
     className="d-grid gap-2 d-md-flex justify-content-md-end",
 )
 
+wave_methods = dbc.RadioItems(
+    id='input-wave-method',
+    options=[
+        {
+            'label': 'Relativistic',
+            'value': 'perturbative'
+        },
+        {
+            'label': 'Hartree-Fock',
+            'value': 'hartree-fock'
+        }
+    ],
+    value='perturbative',
+    inline=True
+)
+
+wave_fields = dbc.RadioItems(
+    id='input-wave-field',
+    options=[
+        {
+            'label': 'P(r)',
+            'value': 'P'
+        },
+        {
+            'label': 'Q(r)',
+            'value': 'Q'
+        },
+        {
+            'label': 'rho(r)',
+            'value': 'rho'
+        }
+    ],
+    value='P',
+    inline=True
+)
+
+wave_panel = dbc.Card(
+    [
+        dbc.Label('Radial wavefunctions'),
+        wave_methods,
+        wave_fields,
+        dcc.Dropdown(
+            multi=True,
+            placeholder="Select orbitals",
+            id='dropdown-wave-orbitals'
+        ),
+        dcc.Graph(id='output-waves'),
+    ],
+    className="mb-3",
+)
+
+error_panel = dbc.Card(
+    [
+        dbc.Label('Mean, max and RMS absolute relative errors against experiment'),
+        dbc.RadioItems(
+            id='input-error-group',
+            options=[
+                {
+                    'label': 'By method',
+                    'value': 'method'
+                },
+                {
+                    'label': 'By shell',
+                    'value': 'shell'
+                },
+                {
+                    'label': 'Selected atom',
+                    'value': 'element'
+                }
+            ],
+            value='method',
+            inline=True
+        ),
+        html.Div(id='output-error-summary'),
+    ],
+    className="mb-3",
+)
+
 content = html.Div(
     [
+        # data of the selected atom (Hartree), shared by the figure callbacks
+        dcc.Store(id='store-bindener'),
+        # methods selected that are not in store-bindener yet, see load_selected_methods
+        dcc.Store(id='store-missing-methods'),
+        # conversion factors and labels used by the clientside callbacks
+        dcc.Store(id='store-units', data=units_data),
         html.H2('Binding Energy Dashboard', style=TEXT_STYLE),
         html.Hr(),
         bindener_graph,
         download_buttons,
+        html.Hr(),
+        wave_panel,
+        error_panel,
         # orbitals_slider
     ],
     style=CONTENT_STYLE
@@ -161,58 +336,228 @@ app.layout = html.Div([
 ])
 
 @app.callback(
+    Output(component_id="store-bindener", component_property="data"),
     Output(component_id="dropdown-methods", component_property="options"),
     Output(component_id="dropdown-methods", component_property="value"),
     Output(component_id="feg-params", component_property="max"),
-    Output(component_id="output-rs", component_property="children"),
-    Output(component_id="output-EF", component_property="children"),
-    Output(component_id="output-bindener", component_property="figure"),
-    # Output(component_id="output-bindener", component_property="config"),
     Input(component_id="input-atoms", component_property="value"),
-    Input(component_id='input-units', component_property='value'),
-    Input(component_id="dropdown-methods", component_property="value"),
-    Input(component_id='feg-params', component_property='value'),
+    State(component_id="dropdown-methods", component_property="value"),
 )
-def update_methods(input_atoms, input_units, input_methods, input_nFEG=0):
+@metrics.timed_callback
+def update_methods(input_atoms, input_methods):
+    '''
+    Loads the data of the atom selected in the browser store. This and load_selected_methods
+    are the only callbacks that read binding energies; the others build or update the figure
+    from the data in the store.
+    '''
+    return atom_data(input_atoms, input_methods)
+
 
+@caching.memoize(callback_cache, version=data_version)
+def atom_data(input_atoms, input_methods):
+    '''
+    Data of the atom with the methods of the default view and those selected (data files
+    of other methods are not read), options and value of the methods dropdown and maximum
+    number of free electrons. Options also list the methods found in the data folder that
+    were not loaded, so that they can be selected.
+    '''
+    data = None
     methods = []
     out_methods = []
-    fig = {}
     max_nFEG = None
-    rs_string = ''
-    Ef_string = ''
-    filename = 'bindener'
-    download = None
 
     if input_atoms:
 
         # create object with bindener data
-        bindener = struc.bindingEnergies(atom_symbol=input_atoms, units=input_units)
-        filename = f'bindener_{bindener.atom_symbol}'
-        
-        # make list of methods with data
-        methods = list(bindener.methods)
-        orbitals = list(bindener.orbitals)
-
-        out_methods = methods
-        ibool = set(methods) == set(input_methods)
-        if not ibool and input_methods:
-            out_methods = input_methods
-
-        # compute FEG parameters
-        max_nFEG = bindener.atom.number
-        if input_nFEG is not None and input_nFEG > 0:
-            units_short = misc.shorten_units(input_units)
-            rs, Ef = bindener.compute_FEG_parameters(input_nFEG)
-            rs_string += f'{rs:.2f} a.u.'
-            Ef_string += f'{Ef:.2f} {units_short}'
-
-        # create figure
-        fig = bindener.binding_energies_graph(orbitals=orbitals, methods=out_methods)
-
-    # return methods, methods, max_nFEG, rs_string, Ef_string, fig, filename
-    # return methods, methods, max_nFEG, rs_string, Ef_string, fig, download
-    return methods, out_methods, max_nFEG, rs_string, Ef_string, fig
+        folders = registry.method_folders(None) + registry.method_folders(input_methods or [])
+        bindener = struc.get_binding_energies(input_atoms, 'Hartree', methods=folders)
+        data = bindener.to_dict()
+        data['requested'] = [store.METHOD_NAMES[folder] for folder in bindener.data_folders]
+
+        # make list of methods with data, then those that can still be loaded
+        methods = data['methods'] + [store.METHOD_NAMES[folder] for folder in bindener_store.available_methods()
+                                     if folder not in bindener.data_folders]
+        out_methods = [method for method in (input_methods or []) if method in data['methods']] or data['methods']
+        max_nFEG = data['number']
+
+    return data, methods, out_methods, max_nFEG
+
+
+# selecting a method that was not loaded reloads the atom data with it
+app.clientside_callback(
+    ClientsideFunction(namespace='bindener', function_name='missing_methods'),
+    Output(component_id="store-missing-methods", component_property="data"),
+    Input(component_id="dropdown-methods", component_property="value"),
+    State(component_id="store-bindener", component_property="data"),
+    prevent_initial_call=True,
+)
+
+
+@app.callback(
+    Output(component_id="store-bindener", component_property="data", allow_duplicate=True),
+    Output(component_id="dropdown-methods", component_property="options", allow_duplicate=True),
+    Output(component_id="dropdown-methods", component_property="value", allow_duplicate=True),
+    Output(component_id="feg-params", component_property="max", allow_duplicate=True),
+    Input(component_id="store-missing-methods", component_property="data"),
+    State(component_id="input-atoms", component_property="value"),
+    State(component_id="dropdown-methods", component_property="value"),
+    prevent_initial_call=True,
+)
+@metrics.timed_callback
+def load_selected_methods(missing, input_atoms, input_methods):
+    if not missing or not input_atoms:
+        return [dash.no_update] * 4
+    return atom_data(input_atoms, input_methods)
+
+
+@app.callback(
+    Output(component_id="output-bindener", component_property="figure"),
+    Input(component_id="store-bindener", component_property="data"),
+    State(component_id="input-units", component_property="value"),
+    State(component_id="dropdown-methods", component_property="value"),
+    State(component_id="feg-params", component_property="value"),
+)
+@metrics.timed_callback
+def draw_bindener(data, input_units, input_methods, input_nFEG):
+    '''
+    Draws the figure of a newly selected atom with every method, hiding those not selected.
+    The last trace is the Fermi energy line. The figure is built from the data in the store,
+    so the atom is not assembled again (e.g. by another worker).
+    '''
+    if not data:
+        return {}
+
+    bindener = struc.bindingEnergies.from_dict(data, input_units)
+    orbitals = list(bindener.orbitals)
+    fig = bindener.binding_energies_figure(orbitals=orbitals, methods=data['methods'])
+    nFEG = input_nFEG or 0
+    if nFEG > 0:
+        bindener.compute_FEG_parameters(nFEG)
+    fig['data'].append(bindener.fermi_line(orbitals, visible=nFEG > 0))
+    for i, method in enumerate(data['methods']):
+        fig['data'][i]['visible'] = method in (input_methods or [])
+
+    return fig
+
+
+# method selection, units and fermi energy only change data already in the browser: they are
+# handled by the clientside functions in assets/bindener_clientside.js
+app.clientside_callback(
+    ClientsideFunction(namespace='bindener', function_name='visible_methods'),
+    Output(component_id="output-bindener", component_property="figure", allow_duplicate=True),
+    Input(component_id="dropdown-methods", component_property="value"),
+    State(component_id="store-bindener", component_property="data"),
+    State(component_id="output-bindener", component_property="figure"),
+    prevent_initial_call=True,
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='bindener', function_name='render_energies'),
+    Output(component_id="output-bindener", component_property="figure", allow_duplicate=True),
+    Input(component_id='input-units', component_property='value'),
+    Input(component_id='feg-params', component_property='value'),
+    State(component_id="store-bindener", component_property="data"),
+    State(component_id="store-units", component_property="data"),
+    State(component_id="output-bindener", component_property="figure"),
+    prevent_initial_call=True,
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='bindener', function_name='fermi_parameters'),
+    Output(component_id="output-rs", component_property="children"),
+    Output(component_id="output-EF", component_property="children"),
+    Input(component_id='feg-params', component_property='value'),
+    Input(component_id='input-units', component_property='value'),
+    Input(component_id="store-bindener", component_property="data"),
+    State(component_id="store-units", component_property="data"),
+)
+
+
+@app.callback(
+    Output(component_id="dropdown-wave-orbitals", component_property="options"),
+    Output(component_id="dropdown-wave-orbitals", component_property="value"),
+    Input(component_id="input-atoms", component_property="value"),
+    Input(component_id="input-wave-method", component_property="value"),
+)
+@metrics.timed_callback
+def update_wave_orbitals(input_atoms, input_method):
+
+    orbitals = []
+    if input_atoms:
+        waves = wave.get_wavefunctions()
+        orbitals = waves.available_orbitals(input_method, input_atoms)
+
+    return orbitals, orbitals
+
+
+@app.callback(
+    Output(component_id="output-waves", component_property="figure"),
+    Input(component_id="input-atoms", component_property="value"),
+    Input(component_id="input-wave-method", component_property="value"),
+    Input(component_id="input-wave-field", component_property="value"),
+    Input(component_id="dropdown-wave-orbitals", component_property="value"),
+)
+@metrics.timed_callback
+def update_waves(input_atoms, input_method, input_field, input_orbitals):
+
+    fig = {}
+    if input_atoms and input_orbitals:
+        fig = struc.wavefunction_figure(input_atoms, orbitals=input_orbitals, data_folder=input_method, field=input_field)
+
+    return fig
+
+@app.callback(
+    Output(component_id="output-error-summary", component_property="children"),
+    Input(component_id="input-error-group", component_property="value"),
+    Input(component_id="input-atoms", component_property="value"),
+)
+@metrics.timed_callback
+def update_error_summary(input_group, input_atoms):
+
+    summary = errors.get_error_engine().summary(input_group)
+    if input_group == 'element':
+        if not input_atoms or input_atoms not in summary.index.get_level_values(0):
+            return ''
+        summary = summary.loc[input_atoms]
+    summary = summary.reset_index().round({'Mean': 4, 'Max': 4, 'RMS': 4, 'Count': 0})
+
+    return dbc.Table.from_dataframe(summary, striped=True, bordered=False, hover=True, size='sm')
+
+@app.callback(
+    Output(component_id="download-data", component_property="data"),
+    Input(component_id="btn_data", component_property="n_clicks"),
+    State(component_id="input-atoms", component_property="value"),
+    State(component_id="input-units", component_property="value"),
+    State(component_id="dropdown-methods", component_property="value"),
+    State(component_id="input-export-format", component_property="value"),
+    prevent_initial_call=True,
+)
+@metrics.timed_callback
+def download_data(n_clicks, input_atoms, input_units, input_methods, input_format):
+    '''
+    Exports the table shown (energies of the methods selected, relative errors and
+    references) straight from the error engine, without building bindingEnergies
+    '''
+    if not input_atoms or not input_methods:
+        return dash.no_update
+
+    engine = errors.get_error_engine(methods=input_methods)
+    chunks = export.export_chunks(engine, input_format, [input_atoms], input_methods, input_units)
+    filename = export.export_filename(input_format, [input_atoms], input_units)
+
+    def write(buffer):
+        for chunk in chunks:
+            buffer.write(chunk)
+
+    return dcc.send_bytes(write, filename)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='bindener', function_name='export_link'),
+    Output(component_id="btn_data_all", component_property="href"),
+    Input(component_id='input-units', component_property='value'),
+    Input(component_id='input-export-format', component_property='value'),
+)
 
 # @app.callback(
 #     Output("download-image", "data"),
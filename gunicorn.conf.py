@@ -0,0 +1,26 @@
+"""
+
+Gunicorn settings for serving the app (gunicorn -c gunicorn.conf.py wsgi:server).
+Workers, threads and address can be set with the environment variables BINDENER_WORKERS,
+BINDENER_THREADS and BINDENER_BIND.
+
+"""
+import gc
+import os
+import multiprocessing
+
+
+bind = os.environ.get('BINDENER_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('BINDENER_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('BINDENER_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('BINDENER_TIMEOUT', 60))
+
+# import the app (and load the data) in the master process, before forking the workers
+preload_app = True
+
+
+def when_ready(server):
+    # move the preloaded objects out of the collector, so that collections in the workers
+    # do not touch (and copy) their pages
+    gc.freeze()
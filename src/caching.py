@@ -0,0 +1,283 @@
+"""
+
+Module with the caches used to avoid rebuilding data on repeated requests: in-process
+(lruCache) and on disk, shared by the processes of a host (diskCache, memoize)
+
+"""
+import os
+import sys
+import glob
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+
+class lruCache:
+    '''
+    Bounded least-recently-used cache with hit/miss counters. Safe to share between threads.
+    '''
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+
+    def peek(self, key, default=None):
+        '''
+        Same as get, without counting a hit or a miss (see record)
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            return default
+
+
+    def record(self, hit):
+        '''
+        Counts a hit or a miss, for lookups of several keys done with peek
+        '''
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.evict()
+
+
+    def evict(self):
+        while len(self.entries) > max(self.maxsize, 0):
+            self.entries.popitem(last=False)
+
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def info(self):
+        '''
+        Returns the cache statistics as a dictionary
+        '''
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'size': len(self.entries),
+                'maxsize': self.maxsize}
+
+
+class diskCache:
+    '''
+    Least-recently-used cache of picklable values stored in a sqlite file. It is shared by
+    all the processes that open the same file (e.g. the workers of a server) and kept
+    across restarts. When the stored values exceed max_bytes the least recently read ones
+    are removed. Errors of the database (read-only or locked file) count as misses.
+    '''
+
+    def __init__(self, path, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+
+    def connection(self):
+        '''
+        Connection of the calling thread, opened again after a fork
+        '''
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+    def get(self, key, default=None):
+        try:
+            conn = self.connection()
+            row = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+                value = pickle.loads(row[0])
+                self.count(True)
+                return value
+        except (sqlite3.Error, OSError, pickle.UnpicklingError):
+            pass
+        self.count(False)
+        return default
+
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        try:
+            conn = self.connection()
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+            self.evict(conn)
+        except (sqlite3.Error, OSError):
+            pass
+
+
+    def evict(self, conn):
+        '''
+        Removes the least recently read entries until the total size is below max_bytes
+        '''
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute('''
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS kept FROM entries)
+                WHERE kept > ?)''', (self.max_bytes,))
+
+
+    def clear(self):
+        try:
+            self.connection().execute('DELETE FROM entries')
+        except (sqlite3.Error, OSError):
+            pass
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+
+    def info(self):
+        '''
+        Returns the cache statistics as a dictionary (size and bytes of the shared file,
+        hits and misses of this process)
+        '''
+        try:
+            size, nbytes = self.connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except (sqlite3.Error, OSError):
+            size, nbytes = 0, 0
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'size': size,
+                'bytes': nbytes,
+                'max_bytes': self.max_bytes}
+
+
+def lru_cache_info(func):
+    '''
+    Statistics of a function wrapped with functools.lru_cache, as returned by info()
+    '''
+    info = func.cache_info()
+    requests = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': info.hits / requests if requests else 0.0,
+        'size': info.currsize,
+        'maxsize': info.maxsize}
+
+
+# python files whose changes invalidate the memoized results (see code_version)
+CODE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(*paths):
+    '''
+    Hash of the contents of the python files of paths (files or folders), computed once
+    per process
+    '''
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, '*.py'))) if os.path.isdir(path) else [path]
+    md5 = hashlib.md5()
+    for fpath in files:
+        with open(fpath, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()[:12]
+
+
+def memoize_key(func, code_hash, args, kwargs, version):
+    '''
+    Key of a call: function name and code, JSON of the arguments and data version
+    '''
+    arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+    return f'{func.__module__}.{func.__qualname__}:{code_hash}:{version}:' + hashlib.sha1(arguments.encode()).hexdigest()
+
+
+def memoize(cache, version=None):
+    '''
+    Decorator caching the results of a function in cache (lruCache or diskCache), keyed on
+    its arguments and on version(), e.g. the data version of the store. Does nothing
+    if cache is None. Changes to the module of the function or to any module of src/ (the
+    code the results depend on, e.g. the format of bindingEnergies.to_dict) invalidate its
+    entries, so a deploy never serves results of the previous code.
+    '''
+    def decorator(func):
+        if cache is None:
+            return func
+        module_file = getattr(sys.modules.get(func.__module__), '__file__', None)
+        paths = (CODE_FOLDER, os.path.abspath(module_file)) if module_file else (CODE_FOLDER, )
+        code_hash = code_version(*paths)
+        missing = object()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = memoize_key(func, code_hash, args, kwargs, version() if version is not None else None)
+            value = cache.get(key, missing)
+            if value is missing:
+                value = func(*args, **kwargs)
+                cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
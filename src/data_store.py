@@ -0,0 +1,400 @@
+"""
+
+Module with the in-memory store of binding energy databases shared by the whole process
+
+"""
+import os
+import glob
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import src.miscellaneous as misc
+import src.orbital_index as orbidx
+import src.method_registry as registry
+import src.metrics as metrics
+
+
+# registered methods (see method_registry), updated in place when methods are registered
+DATA_FOLDERS = registry.DATA_FOLDERS
+METHOD_NAMES = registry.METHOD_NAMES
+SOURCE_PATTERNS = registry.SOURCE_PATTERNS
+
+# compiled columnar copy of the database of each method, written in the main data folder
+BUNDLE_FILENAME = 'bindener_bundle_{folder}.npz'
+
+
+class bindenerStore:
+    '''
+    Read-only store of the binding energy databases found in datafolder. Energies are
+    stored once as float64 Hartree, energies[data_folder][atom_symbol] being a serie indexed
+    by orbital, and converted with a single multiplication when an element is requested.
+
+    Only the methods of the default view (and the reference of the relative errors) are
+    loaded with the store; other registered methods are loaded by load_methods the first
+    time they are requested. loaded lists the data folders read so far.
+
+    data_version is a hash of the source files; it changes whenever the store is
+    reloaded because a file was modified, so it can be used as part of cache keys.
+
+    Each method is read from its compiled bundle (BUNDLE_FILENAME) if it was built from the
+    current source files of the method. Otherwise its sources are parsed and the bundle is
+    rewritten.
+    '''
+
+    def __init__(self, datafolder='./data/', check_interval=1.0, use_bundle=True):
+        self.main_folder = datafolder
+        self.check_interval = check_interval
+        self.use_bundle = use_bundle
+        self.last_check = 0.0
+        self.lock = threading.RLock()
+        self.energies = dict()
+        self.references = dict()
+        self.loaded = []
+        self.table = None
+        self.data_version = None
+        self.load_database()
+
+
+    @metrics.timed('store_load')
+    def load_database(self):
+        '''
+        Reads the databases of the default methods and of those loaded before
+        '''
+        with self.lock:
+            self.load_methods(registry.default_folders() + self.loaded, reload=True)
+            # hashed after loading, the experimental loader may write its processed tables
+            self.data_version = self.source_version()
+            self.last_check = time.monotonic()
+
+
+    def load_methods(self, folders, reload=False):
+        '''
+        Loads the databases of the data folders (and of the reference method) that were not
+        loaded yet, or all of them if reload. Folders missing in the main folder are skipped.
+        Returns the data folders loaded.
+        '''
+        folders = [folder for folder in self.available_methods() if folder in folders or folder == registry.REFERENCE_METHOD]
+        if not reload and all(folder in self.loaded for folder in folders):
+            return []
+        with self.lock:
+            loaded = [] if reload else self.loaded
+            energies = dict() if reload else dict(self.energies)
+            references = dict() if reload else self.references
+            missing = [folder for folder in folders if folder not in loaded]
+            parsed = []
+            read = []
+            for folder in missing:
+                version = self.source_version([folder])
+                data = self.load_bundle(folder, version) if self.use_bundle else None
+                if data is None:
+                    data = self.load_sources(folder)
+                    if data is None:
+                        continue
+                    parsed.append(folder)
+                read.append(folder)
+                energies[folder], folder_references = data
+                if folder == registry.REFERENCE_METHOD:
+                    references = folder_references
+
+            # the new databases replace the old ones at once
+            self.energies = energies
+            self.references = references
+            # methods without data are not marked as loaded
+            self.loaded = [folder for folder in DATA_FOLDERS if folder in loaded or folder in read]
+            self.table = self.build_table()
+            for folder in parsed:
+                self.write_bundle(folder, self.source_version([folder]))
+        return read
+
+
+    @metrics.timed('load_sources')
+    def load_sources(self, folder):
+        '''
+        Parses the source files of the method of folder: returns its energies and references,
+        or None if there are none
+        '''
+        spec = registry.METHODS[folder]
+        try:
+            return spec.loader(os.path.join(self.main_folder, folder), spec.units)
+        except OSError:
+            return None
+
+
+    def available_methods(self):
+        '''
+        Registered data folders found in the main folder
+        '''
+        return [folder for folder in DATA_FOLDERS if os.path.isdir(os.path.join(self.main_folder, folder))]
+
+
+    def flat_table(self, folders=None):
+        '''
+        One row per (method, element, orbital) with the energy in Hartree and the reference, 
+        in the order of the store (only the methods of folders if given)
+        '''
+        blocks = [(data_folder, atom, ener) for data_folder, atoms in self.energies.items() for atom, ener in atoms.items()
+                  if folders is None or data_folder in folders]
+        lengths = [len(ener) for _, _, ener in blocks]
+        references = [self.references[atom].to_numpy(dtype=object)
+                      if data_folder == registry.REFERENCE_METHOD and atom in self.references else np.full(len(ener), np.nan, dtype=object)
+                      for data_folder, atom, ener in blocks]
+        return pd.DataFrame({
+            'method': np.repeat([data_folder for data_folder, _, _ in blocks], lengths),
+            'element': np.repeat([atom for _, atom, _ in blocks], lengths),
+            'orbital': np.concatenate([ener.index.to_numpy(dtype=object) for _, _, ener in blocks]),
+            'energy': np.concatenate([ener.to_numpy(dtype=np.float64) for _, _, ener in blocks]),
+            'reference': np.concatenate(references)})
+
+
+    @metrics.timed('build_table')
+    def build_table(self):
+        '''
+        Long table used by bulk queries: the flat table with atomic numbers and integer 
+        codes for method, element and orbital, sorted by Z, orbital and method
+        '''
+        table = self.flat_table()
+        table['Z'] = table['element'].map(misc.ELEMENTS.symbol_numbers).astype(int)
+        table['method_code'] = table['method'].map({m: i for i, m in enumerate(DATA_FOLDERS)}).astype(int)
+        table['orbital_code'] = table['orbital'].map(orbidx.orbital_sort_key).astype(int)
+        table = table.sort_values(['Z', 'orbital_code', 'method_code'], kind='stable', ignore_index=True)
+        return table
+
+
+    def query(self, elements=None, orbitals=None, methods=None, units='Hartree'):
+        '''
+        Binding energies of any set of elements, orbitals and methods as a long table with
+        columns Z, Element, Orbital, Method, Energy(units) and Reference. None selects all
+        (the methods of the default view for methods).
+
+            elements: symbols or atomic numbers, e.g. ['W', 79]
+            orbitals: nl or nlj labels; non-relativistic values (2p) are returned when any
+                      of their j components (2p-, 2p+) is requested
+            methods:  method names (Experimental, Relativistic, ...) or data folders; methods
+                      not loaded yet are loaded first
+
+        Energies are rounded to 12 significant figures, so values come back as published in
+        their source units. Raises KeyError if methods requested have no data.
+        '''
+        folders = registry.method_folders(methods)
+        self.load_methods(folders)
+        unavailable = [METHOD_NAMES[folder] for folder in folders if folder not in self.loaded]
+        if methods is not None and unavailable:
+            raise KeyError(f'No data for methods {unavailable}.')
+        table = self.table
+        mask = np.isin(table['method_code'].to_numpy(), [DATA_FOLDERS.index(f) for f in folders])
+        if elements is not None:
+            numbers = misc.ELEMENTS.atomic_numbers(elements)
+            mask &= np.isin(table['Z'].to_numpy(), numbers)
+        if orbitals is not None:
+            requested = np.concatenate([orbidx.EXPANSION[orb] for orb in orbitals])
+            labels = table['orbital'].unique()
+            matching = [label for label in labels if np.isin(orbidx.EXPANSION.get(label, []), requested).any()]
+            mask &= table['orbital'].isin(matching).to_numpy()
+
+        selected = table[mask]
+        return pd.DataFrame({
+            'Z': selected['Z'].to_numpy(),
+            'Element': selected['element'].to_numpy(),
+            'Orbital': selected['orbital'].to_numpy(),
+            'Method': selected['method'].map(METHOD_NAMES).to_numpy(),
+            misc.column_name(units): misc.round_significant(misc.convert_energy(selected['energy'].to_numpy(), 'Hartree', units)),
+            'Reference': selected['reference'].to_numpy()})
+
+
+    def bundle_path(self, folder):
+        return os.path.join(self.main_folder, BUNDLE_FILENAME.format(folder=folder))
+
+
+    def bundle_arrays(self, folder, version):
+        '''
+        Flattens the method of folder into columns: one row per (element, orbital) with 
+        integer codes for the labels, float64 energies in Hartree and reference codes 
+        (-1 if the value has no reference)
+        '''
+        table = self.flat_table([folder])
+        atoms = self.energies[folder]
+        index_name = next(iter(atoms.values())).index.name or '' if atoms else ''
+
+        arrays = {'version': np.array(version), 'energy': table['energy'].to_numpy(), 'index_name': np.array(index_name)}
+        for col in ['element', 'orbital', 'reference']:
+            codes, labels = pd.factorize(table[col])
+            arrays[col + '_idx'] = codes.astype(np.int32)
+            arrays[col + '_labels'] = np.asarray(labels, dtype=str)
+        return arrays
+
+
+    def write_bundle(self, folder, version):
+        '''
+        Writes the compiled bundle of the method of folder. The file is replaced atomically
+        so concurrent readers never see a partial bundle; read-only data folders are skipped.
+        '''
+        bundle_path = self.bundle_path(folder)
+        tmp_path = f'{bundle_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **self.bundle_arrays(folder, version))
+            os.replace(tmp_path, bundle_path)
+        except OSError:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
+
+
+    @metrics.timed('load_bundle')
+    def load_bundle(self, folder, version):
+        '''
+        Energies and references of the method of folder read from its compiled bundle, if
+        it was built from the source files with the given version. Returns None if the
+        bundle is missing or stale.
+        '''
+        bundle_path = self.bundle_path(folder)
+        if not os.path.isfile(bundle_path):
+            return None
+        try:
+            with np.load(bundle_path, allow_pickle=False) as bundle:
+                if str(bundle['version']) != version:
+                    return None
+                arrays = {key: bundle[key] for key in bundle.files}
+        except (OSError, ValueError, KeyError):
+            return None
+
+        elements = arrays['element_labels'][arrays['element_idx']]
+        orbitals = arrays['orbital_labels'][arrays['orbital_idx']]
+        is_reference = folder == registry.REFERENCE_METHOD
+        if is_reference:
+            refs = np.where(arrays['reference_idx'] >= 0, arrays['reference_labels'][arrays['reference_idx']], '')
+        index_name = str(arrays['index_name']) or None
+
+        # rows of each element are contiguous and in the source order
+        block = np.flatnonzero(elements[1:] != elements[:-1]) + 1
+        energies = dict()
+        references = dict()
+        for start, stop in zip(np.r_[0, block], np.r_[block, len(elements)]) if len(elements) else []:
+            atom = str(elements[start])
+            index = pd.Index(orbitals[start:stop], name=index_name)
+            energies[atom] = pd.Series(arrays['energy'][start:stop], index=index)
+            if is_reference:
+                references[atom] = pd.Series(refs[start:stop], index=index)
+        return energies, references
+
+
+    def source_files(self, folders=None):
+        '''
+        Lists the files read by the loaders (of the methods of folders if given), sorted by path
+        '''
+        files = []
+        for data_folder, patterns in SOURCE_PATTERNS.items():
+            if folders is not None and data_folder not in folders:
+                continue
+            for pattern in patterns:
+                files += glob.glob(os.path.join(self.main_folder, data_folder, pattern))
+        return sorted(files)
+
+
+    def source_version(self, folders=None):
+        '''
+        Hash of the path, size and modification time of every source file (of the methods
+        of folders if given)
+        '''
+        md5 = hashlib.md5()
+        for fpath in self.source_files(folders):
+            stat = os.stat(fpath)
+            relpath = os.path.relpath(fpath, self.main_folder)
+            md5.update(f'{relpath}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return md5.hexdigest()[:16]
+
+
+    def refresh_if_stale(self):
+        '''
+        Reloads the databases if any source file changed since they were loaded. Files
+        are checked at most once every check_interval seconds.
+        '''
+        if time.monotonic() - self.last_check < self.check_interval:
+            return False
+        with self.lock:
+            self.last_check = time.monotonic()
+            if self.source_version() == self.data_version:
+                return False
+            self.load_database()
+        return True
+
+
+    def memory_usage(self):
+        '''
+        Bytes held by the long table and the series of energies and references
+        '''
+        series = [serie for folder in self.energies.values() for serie in folder.values()]
+        series += list(self.references.values())
+        return {
+            'table': int(self.table.memory_usage(deep=True).sum()) if self.table is not None else 0,
+            'series': int(sum(serie.memory_usage(deep=True) for serie in series))}
+
+
+    def element_energies(self, data_folder, atom_symbol):
+        '''
+        Returns the serie of binding energies (Hartree) of atom_symbol in data_folder. 
+        Raises KeyError if there is no data for it.
+        '''
+        return self.energies[data_folder][atom_symbol]
+
+
+    def element_binding_energies(self, data_folder, atom_symbol, units):
+        '''
+        Returns a new dataframe with the binding energies of atom_symbol in data_folder 
+        converted to units
+        '''
+        if data_folder not in self.energies:
+            return None
+        ener = self.element_energies(data_folder, atom_symbol)
+        df = pd.DataFrame({misc.column_name(units): misc.convert_energy(ener, 'Hartree', units)})
+        if data_folder == registry.REFERENCE_METHOD:
+            df['Reference'] = self.references[atom_symbol]
+        return df
+
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+def query_binding_energies(elements=None, orbitals=None, methods=None, units='Hartree', datafolder='./data/'):
+    '''
+    Bulk query of the process-wide store, see bindenerStore.query. Example:
+
+    >> query_binding_energies(['Au', 'W'], ['4f-', '4f+'], ['Experimental', 'Hartree-Fock'], 'eV')
+    '''
+    data_store = get_store(datafolder)
+    data_store.refresh_if_stale()
+    return data_store.query(elements, orbitals, methods, units)
+
+
+def get_store(datafolder='./data/'):
+    '''
+    Returns the process-wide store for datafolder, loading it the first time it is requested
+    '''
+    key = os.path.abspath(datafolder)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = bindenerStore(datafolder)
+    return _stores[key]
+
+
+def build_bundle(datafolder='./data/'):
+    '''
+    Parses the sources of every registered method found in datafolder and (re)writes their
+    compiled bundles
+    '''
+    data_store = bindenerStore(datafolder, use_bundle=False)
+    data_store.load_methods(data_store.available_methods())
+    paths = [data_store.bundle_path(folder) for folder in data_store.energies]
+    for path in paths:
+        if not os.path.isfile(path):
+            raise OSError(f'{path} could not be written.')
+    return paths
+
+
+if __name__ == '__main__':
+    import sys
+    print('\n'.join(build_bundle(*sys.argv[1:2])))
@@ -0,0 +1,169 @@
+"""
+
+Module for computing the relative errors of every method against experiment for all the
+elements at once
+
+"""
+import threading
+import numpy as np
+import pandas as pd
+import src.data_store as store
+import src.method_registry as registry
+import src.orbital_index as orbidx
+import src.metrics as metrics
+
+
+STATISTICS = ['Mean', 'Max', 'RMS', 'Count']
+GROUPS = ['method', 'element', 'shell', 'orbital']
+
+
+class errorEngine:
+    '''
+    Relative errors (exp - calc) / exp of every (element, orbital, method) computed in one
+    pass over the methods loaded in the store. Non-relativistic energies are compared with
+    both j components.
+    Experimental values equal to zero (e.g. Eu 4f, at the Fermi level) give no error.
+    Aggregated statistics of the absolute relative errors are computed once per grouping.
+    '''
+
+    @metrics.timed('error_engine')
+    def __init__(self, data_store):
+        self.data_version = data_store.data_version
+        self.loaded = list(data_store.loaded)
+        # data folders of the methods of the cube, in the order of the registry
+        self.folders = [folder for folder in store.DATA_FOLDERS
+                        if folder == registry.REFERENCE_METHOD or folder in data_store.energies]
+        self.summaries = dict()
+        self.atomic_numbers, self.elements, self.orbital_codes, self.energies, self.references = self.energy_cube(data_store.table)
+        self.orbitals = orbidx.orbital_labels(self.orbital_codes)
+        self.methods, self.errors = self.relative_errors(self.energies)
+
+
+    def memory_usage(self):
+        '''
+        Bytes held by the energy cube and the relative errors
+        '''
+        return int(self.energies.nbytes + self.errors.nbytes)
+
+
+    def energy_cube(self, table):
+        '''
+        Places the energies (Hartree) of the long table in an (element x orbital x method)
+        cube, methods in the order of self.folders, and the references of the
+        experimental values in an (element x orbital) array
+        '''
+        elements = table.drop_duplicates('Z')[['Z', 'element']]
+        z_idx = np.searchsorted(elements['Z'].to_numpy(), table['Z'].to_numpy())
+
+        # expand non-relativistic rows to their nlj codes
+        codes = [orbidx.EXPANSION[orb] for orb in table['orbital']]
+        counts = np.array([len(code) for code in codes])
+        orb_codes = np.concatenate(codes)
+        orbitals = np.unique(orb_codes)
+        o_idx = np.searchsorted(orbitals, orb_codes)
+
+        z_idx = np.repeat(z_idx, counts)
+        # registry codes of the methods to their position in the cube
+        positions = np.full(len(store.DATA_FOLDERS), -1)
+        positions[[store.DATA_FOLDERS.index(folder) for folder in self.folders]] = np.arange(len(self.folders))
+        method_codes = np.repeat(positions[table['method_code'].to_numpy()], counts)
+        cube = np.full((len(elements), len(orbitals), len(self.folders)), np.nan)
+        cube[z_idx, o_idx, method_codes] = np.repeat(table['energy'].to_numpy(), counts)
+
+        references = np.full((len(elements), len(orbitals)), None, dtype=object)
+        is_exp = method_codes == self.folders.index(registry.REFERENCE_METHOD)
+        references[z_idx[is_exp], o_idx[is_exp]] = np.repeat(table['reference'].to_numpy(dtype=object), counts)[is_exp]
+        return elements['Z'].to_numpy(), elements['element'].to_numpy(), orbitals, cube, references
+
+
+    def relative_errors(self, cube):
+        '''
+        Compares every method with the experimental layer of the cube at once
+        '''
+        iexp = self.folders.index(registry.REFERENCE_METHOD)
+        icalc = [i for i in range(len(self.folders)) if i != iexp]
+        exp = cube[:, :, iexp:iexp + 1]
+        exp = np.where(exp == 0, np.nan, exp)
+        errors = (exp - cube[:, :, icalc]) / exp
+        methods = [store.METHOD_NAMES[self.folders[i]] for i in icalc]
+        return methods, errors
+
+
+    def long_errors(self):
+        '''
+        Relative errors as a long table with columns Z, Element, Orbital, Method and Relative error
+        '''
+        iz, io, im = np.nonzero(~np.isnan(self.errors))
+        return pd.DataFrame({
+            'Z': self.atomic_numbers[iz],
+            'Element': self.elements[iz],
+            'Orbital': self.orbitals[io],
+            'Method': np.asarray(self.methods)[im],
+            'Relative error': self.errors[iz, io, im]})
+
+
+    def summary(self, by='method'):
+        '''
+        Mean, max and RMS of the absolute relative errors (and number of values) grouped by
+        method, element, shell (n) or orbital. Results are cached.
+        '''
+        if by not in GROUPS:
+            raise ValueError(f'by must be one of {GROUPS}.')
+        if by not in self.summaries:
+            self.summaries[by] = self.compute_summary(by)
+        return self.summaries[by]
+
+
+    def compute_summary(self, by):
+        abs_err = np.abs(self.errors)
+        if by == 'method':
+            stats = error_statistics(abs_err.reshape(-1, len(self.methods)), axis=0)
+            return pd.DataFrame(np.column_stack(stats), index=pd.Index(self.methods, name='Method'), columns=STATISTICS)
+        if by == 'element':
+            stats = error_statistics(abs_err, axis=1)
+            labels = self.elements
+        elif by == 'orbital':
+            stats = error_statistics(abs_err, axis=0)
+            labels = self.orbitals
+        else:
+            shells = orbidx.ORBITALS['n'].to_numpy()[self.orbital_codes]
+            labels = np.unique(shells)
+            stats = [np.stack(s) for s in zip(*[error_statistics(abs_err[:, shells == n], axis=(0, 1)) for n in labels])]
+        index = pd.MultiIndex.from_product([labels, self.methods], names=[by.capitalize(), 'Method'])
+        summary = pd.DataFrame(np.column_stack([s.reshape(-1) for s in stats]), index=index, columns=STATISTICS)
+        return summary[summary['Count'] > 0]
+
+
+def error_statistics(values, axis):
+    '''
+    Mean, max, RMS and number of the non-NaN values along axis
+    '''
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=axis)
+    zeros = np.where(valid, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = zeros.sum(axis=axis) / count
+        rms = np.sqrt((zeros ** 2).sum(axis=axis) / count)
+    vmax = np.where(count > 0, np.where(valid, values, -np.inf).max(axis=axis), np.nan)
+    return mean, vmax, rms, count.astype(np.float64)
+
+
+_engines = dict()
+_engines_lock = threading.Lock()
+
+
+def get_error_engine(datafolder='./data/', methods=None):
+    '''
+    Returns the error engine of the process-wide store, rebuilding it when the data changes
+    or other methods are loaded. methods (names or data folders) are loaded if they were not.
+    '''
+    data_store = store.get_store(datafolder)
+    data_store.refresh_if_stale()
+    if methods is not None:
+        data_store.load_methods(registry.method_folders(methods))
+    key = data_store.main_folder
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None or engine.data_version != data_store.data_version or engine.loaded != data_store.loaded:
+            engine = _engines[key] = errorEngine(data_store)
+    return engine
@@ -5,9 +5,23 @@ Module for processing and reading experimental binding energies database
 @author: Ale Mendez
 """
 import pandas as pd
+import numpy as np
 import os 
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import src.miscellaneous as misc
 
+
+FOOTNOTE = (
+    '\n# References:\n'+
+    '# Experimental values compiled by Williams, G. (1995)\n'+
+    '# 1. J. A. Bearden and A. F. Burr, "Reevaluation of X­Ray Atomic Energy Levels," Rev. Mod. Phys. 39, (1967) p.125\n'+
+    '# 2. M. Cardona and L. Ley, Eds., Photoemission in Solids I: General Principles (Springer­Verlag, Berlin, 1978), with additional corrections\n'+
+    '# 3. J. C. Fuggle and N. Mårtensson, "Core­Level Binding Energies in Metals", J. Electron Spectrosc. Relat. Phenom. 21, (1980) p.275\n'+
+    '# a. One-particle approximation not valid owing to short core-hole lifetime.\n'+
+    '# b. Value derived from Ref. [1].')
+
+
 class experimentalData:
 
 
@@ -35,16 +49,20 @@ class experimentalData:
         '''
         Read all the experimental binding energy data available
         '''
-        proc_raw = self.check_database_files(key='raw')
+        self.check_database_files(key='raw')
         proc_other = self.check_database_files()
-        if proc_raw and not proc_other:
-            self.load_raw_table()
-        elif proc_other:
+        if proc_other and not self.raw_table_is_newer():
             self.load_energy_table()
             self.load_reference_table()
         else:
+            # processed tables are missing or outdated: rebuild them from the raw table, and
+            # keep the tables parsed in memory if they cannot be written (read-only folder)
+            self.load_raw_table()
             self.proc_raw_table()
-            self.write_processed_tables()
+            try:
+                self.write_processed_tables()
+            except OSError:
+                pass
 
 
     def check_database_files(self, key=None):
@@ -64,6 +82,11 @@ class experimentalData:
         return True
 
 
+    def raw_table_is_newer(self):
+        raw_mtime = os.path.getmtime(self.raw_file_path)
+        return any(os.path.getmtime(self.processed_filepath(key)) < raw_mtime for key in self.file_proc_key)
+
+
     def load_raw_table(self):
         self.raw_table = pd.read_csv(self.raw_file_path, sep='\t', index_col=0)
         self.define_global_variables(self.raw_table)
@@ -94,41 +117,37 @@ class experimentalData:
 
 
     def proc_raw_table(self):
-        self.proc_references()
-        self.proc_data()
+        '''
+        Function to convert the raw table into numeric energies and numeric references. All
+        cells are parsed in a single column-wise pass with vectorized string operations.
+        '''
+        cells = self.raw_table[self.orbs].stack().dropna().astype(str)
+        self.ref_table = self.raw_table.copy()
+        self.ref_table[self.orbs] = self.parse_references(cells).unstack().reindex(index=self.idx, columns=self.orbs)
+        self.dat_table = self.raw_table.copy()
+        self.dat_table[self.orbs] = self.parse_energies(cells).unstack().reindex(index=self.idx, columns=self.orbs)
 
 
-    def proc_references(self):
+    def parse_references(self, cells):
         '''
-        Function to convert references flags in raw data to numeric references
+        Function to convert references flags in raw data to numeric references, e.g. '95.6+a'
+        gives "[3, 'a']" (no flag: 1, '*': 2, '+': 3)
         '''
-        self.ref_table = self.raw_table.copy()
-        for i in self.idx: 
-            for o in self.orbs:
-                val = self.raw_table.loc[i][o]
-                ref = val
-                if not misc.isNaN(val): 
-                     ref = [1]
-                     if '*' in val: ref = [2]
-                     if '+' in val: ref = [3]
-                     if 'a' in val: ref.append('a')
-                     if 'b' in val: ref.append('b')
-                self.ref_table.at[i,o] = ref
+        flag = np.where(cells.str.contains('+', regex=False), '3',
+               np.where(cells.str.contains('*', regex=False), '2', '1'))
+        note_a = np.where(cells.str.contains('a', regex=False), ", 'a'", '')
+        note_b = np.where(cells.str.contains('b', regex=False), ", 'b'", '')
+        refs = np.char.add(np.char.add(np.char.add('[', flag), np.char.add(note_a, note_b)), ']')
+        return pd.Series(refs, index=cells.index, dtype=object)
 
 
-    def proc_data(self):
+    def parse_energies(self, cells):
         '''
-        Function to process data table: convert string values to float values
+        Function to convert string values to float values
         '''
-        self.dat_table = self.raw_table.copy()
-        for i in self.idx: 
-            for o in self.orbs:
-                val = self.raw_table.loc[i][o]
-                if not misc.isNaN(val): 
-                    for char in '*+ab': val = val.replace(char,'')
-                    if 'g' in val: val = val.replace('g','9') # fix on Williams compilation pdf
-                    val = float(val)
-                self.dat_table.at[i,o] = val
+        values = cells.str.replace(r'[*+ab]', '', regex=True)
+        values = values.str.replace('g', '9', regex=False) # fix on Williams compilation pdf
+        return values.astype(np.float64)
 
 
     def element_binding_energies(self, element_str, bprint=False):
@@ -140,12 +159,13 @@ class experimentalData:
             print: (bool) print output file with element data
 
         '''
-        # define an element object (inherits methods from periodictable.elements module)
-        element = misc.periodic_table(element_str)
-        self.check_element_data(element.symbol)
+        # symbol and atomic number from the element index (symbol, name or number)
+        number = misc.ELEMENTS.atomic_number(element_str)
+        symbol = misc.ELEMENTS.symbols[number]
+        self.check_element_data(symbol)
 
-        self.bindener = self.extract_element_data(element.number)
-        if bprint: self.print_element_data(element.symbol)
+        self.bindener = self.extract_element_data(number)
+        if bprint: self.print_element_data(symbol)
         return self.bindener
 
 
@@ -157,39 +177,34 @@ class experimentalData:
             raise ValueError(f'No data found for {element_symbol}.')
 
 
-    def extract_element_data(self, element_number):
+    def extract_element_data(self, element_number, units=None):
         '''
         Extracts binding energy data from table according to element selected
         '''
+        if units is None: units = self.units
         defcolname = misc.column_name('eV')
-        colname = misc.column_name(self.units)
-        ener = self.dat_table.loc[element_number][1:].tolist()
+        colname = misc.column_name(units)
+        ener = self.dat_table.loc[element_number][1:].to_numpy(dtype=np.float64)
         bindener = pd.DataFrame(index=self.orbs)
         bindener.index.name = 'Orbital'
         bindener[defcolname] = ener
-        bindener[colname] = [misc.convert_energy_from_eV(e, self.units) for e in ener]
+        bindener[colname] = misc.convert_energy_from_eV(bindener[defcolname], units)
         bindener['Reference'] = self.ref_table.loc[element_number][1:].tolist()
         bindener = bindener.dropna()
         return bindener
 
 
-    def print_element_data(self, element_symbol):
+    def print_element_data(self, element_symbol, folder=None):
         '''
         Function to print binding energy data for selected element in units defined
         '''
-        fout = os.path.join(self.folder, element_symbol+'_experiment.dat')
-        colname = misc.column_name(self.units)
+        if folder is None: folder = self.folder
+        fout = os.path.join(folder, element_symbol+'_experiment.dat')
         print_bindener = self.bindener.dropna()
-        dictdata = dict(zip(print_bindener.index, print_bindener[colname]))
+        text = element_file_text(print_bindener.index, print_bindener[misc.column_name('eV')].to_numpy(),
+                                 print_bindener['Reference'], self.units)
         with open(fout, 'w') as f:
-            print("{}\t{}\t{}".format('Orb', colname, 'Reference'), file=f)
-            for orb, ener_val in dictdata.items():
-                if not misc.isNaN(ener_val) and 'eV' not in self.units: 
-                    ref = self.bindener.loc[orb]['Reference']
-                    ener_eV = self.bindener.loc[orb][misc.column_name('eV')]
-                    ener_val = self.significant_figures(ener_eV, ener_val)
-                print("{}\t{}\t{}".format(orb, ener_val, ref),file=f)
-            self.print_footnote(f)
+            f.write(text)
 
 
     def significant_figures(self, ener, conv):
@@ -197,44 +212,109 @@ class experimentalData:
         Function to truncate the converted energy values with the same number of
         significate figures as experimental data
         '''
-        from math import log10
-        if ener == 0:
-            return str(ener)
-        # count the number of significate figures (icsig) in experimental value (eV)
-        for i in range(6):
-            a = ener*(10**i)
-            Da = a-round(a)
-            if Da == 0: 
-                iord = i
-                icsig = int(log10(abs(ener*10**iord)))+1
-                break
-        # truncate converted values using icsing 
-        aux = 1
-        if conv<1: aux += 1 # add one more integer for "0."
-        if conv<0.1: aux += 1 # add one more integer for "0.0"
-        if conv<0.01: aux += 1 # add one more integer for "0.00"
-        if conv<0.001: aux += 1 # add one more integer for "0.000"
-        conv_string = str(conv)[:icsig+aux] # valores truncados (no redondeados) <=== CAMBIAR a redondear
-        return conv_string
+        return significant_figures(np.array([ener]), np.array([conv]))[0]
 
 
     def print_footnote(self, f):
         '''
         Function to print footnote with references
         '''
-        print('\n# References:', file=f)
-        print('# Experimental values compiled by Williams, G. (1995)', file=f)
-        print('# 1. J. A. Bearden and A. F. Burr, "Reevaluation of X­Ray Atomic Energy Levels," Rev. Mod. Phys. 39, (1967) p.125\n'+
-              '# 2. M. Cardona and L. Ley, Eds., Photoemission in Solids I: General Principles (Springer­Verlag, Berlin, 1978), with additional corrections\n'+
-              '# 3. J. C. Fuggle and N. Mårtensson, "Core­Level Binding Energies in Metals", J. Electron Spectrosc. Relat. Phenom. 21, (1980) p.275\n'+
-              '# a. One-particle approximation not valid owing to short core-hole lifetime.\n'+
-              '# b. Value derived from Ref. [1].', file=f)
+        print(FOOTNOTE, file=f)
+
+
+    def write_element_files(self, units=None, folder=None, elements=None, processes=None):
+        '''
+        Writes the <element>_experiment.dat files of elements (all by default) in units.
+        Elements are split in chunks formatted and written by a pool of processes.
+        '''
+        if units is None: units = self.units
+        if folder is None: folder = self.folder
+        if elements is None: elements = self.elements
+        self.check_database_files(key='raw')
+        rows = [self.elements.index(el) for el in elements]
+        energies = self.dat_table[self.orbs].to_numpy(dtype=np.float64)[rows]
+        references = self.ref_table[self.orbs].to_numpy(dtype=object)[rows]
+
+        processes = processes or os.cpu_count() or 1
+        nchunks = min(processes, len(rows))
+        chunks = [(folder, units, list(self.orbs), [elements[i] for i in idx], energies[idx], references[idx])
+                  for idx in np.array_split(np.arange(len(rows)), nchunks) if len(idx)]
+        if nchunks <= 1:
+            return [fout for chunk in chunks for fout in write_element_chunk(chunk)]
+        with ProcessPoolExecutor(max_workers=nchunks) as pool:
+            return [fout for fouts in pool.map(write_element_chunk, chunks) for fout in fouts]
 
 
     def write_processed_tables(self):
-        # print reference table to file
-        refpath = self.processed_filepath(self.file_proc_key[1])
-        self.ref_table.to_csv(refpath, sep='\t')
-        # print energy table to file
-        datpath = self.processed_filepath(self.file_proc_key[0])
-        self.dat_table.to_csv(datpath, sep='\t')
\ No newline at end of file
+        # print reference and energy tables to file, through temporary files so that a failed
+        # write does not leave truncated tables behind
+        tables = {self.file_proc_key[1]: self.ref_table, self.file_proc_key[0]: self.dat_table}
+        for key, table in tables.items():
+            path = self.processed_filepath(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            try:
+                table.to_csv(tmp_path, sep='\t')
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+def significant_figures(ener, conv):
+    '''
+    Truncates the converted energies conv to the number of significant figures of the
+    experimental values ener (eV), for arrays of values at once. Returns an array of strings.
+    '''
+    ener = np.asarray(ener, dtype=np.float64)
+    conv = np.asarray(conv, dtype=np.float64)
+    # count the number of significant figures (icsig) in experimental value (eV)
+    scaled = ener[:, None] * 10.0 ** np.arange(6)
+    is_integer = scaled == np.round(scaled)
+    iord = np.where(is_integer.any(axis=1), is_integer.argmax(axis=1), 6)
+    with np.errstate(divide='ignore'):
+        icsig = np.floor(np.log10(np.abs(ener * 10.0 ** iord)))
+    icsig = np.where(ener == 0, 0, icsig).astype(int) + 1
+    # truncate converted values using icsig, with one more character for "0.", "0.0", ...
+    aux = 1 + (conv < 1).astype(int) + (conv < 0.1) + (conv < 0.01) + (conv < 0.001)
+    strings = np.array([str(value) for value in conv.tolist()], dtype=object)
+    truncated = np.array([string[:n] for string, n in zip(strings, (icsig + aux).tolist())], dtype=object)
+    return np.where(ener == 0, np.array([str(value) for value in ener.tolist()], dtype=object), truncated)
+
+
+def element_file_text(orbitals, ener_eV, references, units):
+    '''
+    Content of an <element>_experiment.dat file: energies of orbitals (non-NaN) converted
+    from eV to units, truncated to the significant figures of the eV values
+    '''
+    ener_eV = np.asarray(ener_eV, dtype=np.float64)
+    conv = misc.convert_energy(ener_eV, 'eV', units)
+    values = [str(value) for value in conv.tolist()] if 'eV' in units else significant_figures(ener_eV, conv)
+    lines = ["{}\t{}\t{}".format('Orb', misc.column_name(units), 'Reference')]
+    lines += ["{}\t{}\t{}".format(orb, value, ref) for orb, value, ref in zip(orbitals, values, references)]
+    return '\n'.join(lines) + '\n' + FOOTNOTE + '\n'
+
+
+def write_element_chunk(chunk):
+    '''
+    Writes the files of a chunk of elements (run by the worker processes of write_element_files)
+    '''
+    folder, units, orbitals, elements, energies, references = chunk
+    orbitals = np.asarray(orbitals, dtype=object)
+    fouts = []
+    for element, ener, refs in zip(elements, energies, references):
+        valid = ~np.isnan(ener)
+        fout = os.path.join(folder, element+'_experiment.dat')
+        with open(fout, 'w') as f:
+            f.write(element_file_text(orbitals[valid], ener[valid], refs[valid], units))
+        fouts.append(fout)
+    return fouts
+
+
+if __name__ == '__main__':
+    # python -m src.experimental_enerdata [units] [data folder] [output folder]
+    units = sys.argv[1] if len(sys.argv) > 1 else 'Hartree'
+    folder = sys.argv[2] if len(sys.argv) > 2 else './data/experimental'
+    outfolder = sys.argv[3] if len(sys.argv) > 3 else folder
+    os.makedirs(outfolder, exist_ok=True)
+    fouts = experimentalData(folder, units).write_element_files(folder=outfolder)
+    print(f'{len(fouts)} files written in {outfolder}')
@@ -0,0 +1,173 @@
+"""
+
+Module for exporting binding energies, relative errors and references as CSV, JSON or
+Parquet. Tables are cut from the energy cube of the error engine one element at a time and
+encoded in chunks, so exporting the whole periodic table never holds a second copy of it.
+
+"""
+import io
+import json
+import numpy as np
+import pandas as pd
+import src.miscellaneous as misc
+import src.data_store as store
+import src.method_registry as registry
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'parquet': 'application/vnd.apache.parquet'}
+
+
+def parquet_available():
+    '''
+    Parquet files are written with pyarrow, which is optional
+    '''
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def json_values(df):
+    '''
+    Rows of df as lists of python values, NaN as None, so that json.dumps writes floats with
+    their shortest repr (as the CSV output) and missing values as null
+    '''
+    values = df.astype(object)
+    return values.where(values.notna(), None).to_numpy().tolist()
+
+
+def export_columns(methods, units):
+    '''
+    Column names of the export of methods (names): energies, relative errors of the
+    calculated methods and reference of the experimental values
+    '''
+    units_short = misc.shorten_units(units)
+    columns = ['Z', 'Element', 'Orbital'] + [f'{method} ({units_short})' for method in methods]
+    columns += [f'{method} rel. error' for method in methods if method != store.METHOD_NAMES[registry.REFERENCE_METHOD]]
+    return columns + ['Reference']
+
+
+def element_table(engine, iz, methods=None, units='Hartree'):
+    '''
+    Table of the element at position iz of the error engine with the energies of methods
+    in units, their relative errors and the references (methods of the default view if
+    None, those not loaded in the engine are left out). Orbitals without values of any of
+    the methods are left out.
+    '''
+    folders = [folder for folder in registry.method_folders(methods) if folder in engine.folders]
+    names = [store.METHOD_NAMES[folder] for folder in folders]
+    codes = [engine.folders.index(folder) for folder in folders]
+
+    # rounded so that values come back as published in their source units
+    energies = misc.round_significant(engine.energies[iz][:, codes] * misc.conversion_factor('Hartree', units))
+    rows = ~np.isnan(energies).all(axis=1)
+    calc = [engine.methods.index(name) for name in names if name in engine.methods]
+    values = np.column_stack([energies[rows], engine.errors[iz][rows][:, calc]])
+
+    table = pd.DataFrame(values, columns=export_columns(names, units)[3:-1])
+    table.insert(0, 'Orbital', engine.orbitals[rows])
+    table.insert(0, 'Element', engine.elements[iz])
+    table.insert(0, 'Z', engine.atomic_numbers[iz])
+    table['Reference'] = engine.references[iz][rows]
+    return table
+
+
+def element_positions(engine, elements=None):
+    '''
+    Positions in the error engine of elements given by symbol or atomic number (None
+    selects all). Raises KeyError for elements without data.
+    '''
+    if elements is None:
+        return range(len(engine.elements))
+    numbers = list(engine.atomic_numbers)
+    symbols = list(engine.elements)
+    return [numbers.index(el) if isinstance(el, (int, np.integer)) else symbols.index(el) for el in elements]
+
+
+def export_chunks(engine, fmt, elements=None, methods=None, units='Hartree'):
+    '''
+    Yields the encoded export of elements in fmt ('csv', 'json' or 'parquet'), one chunk
+    per element
+    '''
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'fmt must be one of {list(EXPORT_FORMATS)}.')
+    try:
+        positions = element_positions(engine, elements)
+    except ValueError as error:
+        raise KeyError(f'No data for elements {elements}.') from error
+    tables = (element_table(engine, iz, methods, units) for iz in positions)
+
+    if fmt == 'csv':
+        for i, table in enumerate(tables):
+            yield table.to_csv(index=False, header=i == 0).encode()
+    elif fmt == 'json':
+        yield b'['
+        separator = ''
+        for table in tables:
+            if len(table):
+                records = [dict(zip(table.columns, row)) for row in json_values(table)]
+                yield (separator + json.dumps(records)[1:-1]).encode()
+                separator = ', '
+        yield b']'
+    else:
+        yield from parquet_chunks(tables)
+
+
+class byteSink(io.RawIOBase):
+    '''
+    Write-only file that hands over what was written since the last drain
+    '''
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+
+    def tell(self):
+        return self.position
+
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(tables):
+    '''
+    Writes each table as a row group of a single Parquet file, yielding the bytes written
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = byteSink()
+    writer = None
+    for table in tables:
+        if writer is None:
+            types = {'Z': pa.int64(), 'Element': pa.string(), 'Orbital': pa.string(), 'Reference': pa.string()}
+            schema = pa.schema([(col, types.get(col, pa.float64())) for col in table.columns])
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(pa.Table.from_pandas(table, schema=schema, preserve_index=False))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def export_filename(fmt, elements=None, units='Hartree'):
+    label = 'all' if elements is None else '_'.join(str(el) for el in elements)
+    return f'bindener_{label}_{units}.{fmt}'
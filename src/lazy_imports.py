@@ -0,0 +1,39 @@
+"""
+
+Module for importing heavy modules that are only used in some code paths. A stand-in is
+returned at once and the module is imported the first time one of its attributes is used,
+e.g.
+
+    go = lazy_import('plotly.graph_objects')
+    fig = go.Figure()   # plotly.graph_objects is imported here
+
+Stand-ins are not placed in sys.modules, so tools that walk over the imported modules
+(e.g. inspect, used by Dash at startup) do not trigger the import.
+
+"""
+import sys
+import types
+import importlib
+
+
+class lazyModule(types.ModuleType):
+    '''
+    Module object that imports the module of the same name on first attribute access
+    and forwards every attribute to it
+    '''
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name):
+    '''
+    Returns module name if it is already imported, or a stand-in importing it on first use
+    '''
+    module = sys.modules.get(name)
+    return module if module is not None else lazyModule(name)
@@ -0,0 +1,153 @@
+"""
+
+Registry of the methods of binding energies. Each data folder registers the loader of its
+source files, their energy units, the orbital convention of the method and the marker of
+its points in the figures:
+
+    register_method('mcdhf', 'MCDHF', load_theoretical, ['*/bindener.dat'],
+                    units='Hartree', orbitals='nlj', marker='star-open', default=False)
+
+Methods are listed in the order they were registered. Those of the default view are loaded
+with the store; the others (default=False) are only read when they are requested, so adding
+them does not slow down the default view. The reference method is always loaded, as the
+relative errors are computed against it.
+
+"""
+import numpy as np
+import pandas as pd
+import src.miscellaneous as misc
+import src.experimental_enerdata as expapp
+import src.theoretical_enerdata as theoapp
+
+
+# methods are compared with the values of this data folder
+REFERENCE_METHOD = 'experimental'
+
+ORBITAL_CONVENTIONS = ['nl', 'nlj']
+
+# registered methods: data folders in order, names shown in tables and figures and files
+# read by the loaders of each data folder. Lists and dictionaries are updated in place by
+# register_method, so they can be imported by other modules.
+METHODS = dict()
+DATA_FOLDERS = []
+METHOD_NAMES = dict()
+SOURCE_PATTERNS = dict()
+
+
+class methodSpec:
+    '''
+    Description of a method:
+
+        folder:   data folder of the source files
+        name:     name shown in tables and figures
+        loader:   loader(pathdir, units) returns the energies (Hartree) of every element as
+                  {symbol: serie indexed by orbital} and the references of the values
+                  (an empty dictionary if there are none)
+        patterns: glob patterns of the source files, relative to the data folder
+        units:    energy units of the source files
+        orbitals: 'nl' for non-relativistic methods (one value per nl orbital) or 'nlj'
+        marker:   marker symbol of the method in the figures
+        default:  whether the method is loaded and shown in the default view
+    '''
+
+    def __init__(self, folder, name, loader, patterns, units='Hartree', orbitals='nlj', marker='circle-open', default=True):
+        self.folder = folder
+        self.name = name
+        self.loader = loader
+        self.patterns = list(patterns)
+        self.units = units
+        self.orbitals = orbitals
+        self.marker = marker
+        self.default = default
+
+
+def register_method(folder, name, loader, patterns, units='Hartree', orbitals='nlj', marker='circle-open', default=True):
+    '''
+    Adds a method to the registry, or replaces the method registered for folder. See methodSpec.
+    '''
+    if orbitals not in ORBITAL_CONVENTIONS:
+        raise ValueError(f'orbitals must be one of {ORBITAL_CONVENTIONS}.')
+    if units not in misc.ENERGY_UNITS_PER_HARTREE:
+        raise ValueError(f'units must be one of {list(misc.ENERGY_UNITS_PER_HARTREE)}.')
+    if any(spec.name == name and spec.folder != folder for spec in METHODS.values()):
+        raise ValueError(f'A method named {name} is already registered.')
+
+    spec = methodSpec(folder, name, loader, patterns, units, orbitals, marker, default)
+    if folder not in METHODS:
+        DATA_FOLDERS.append(folder)
+    METHODS[folder] = spec
+    METHOD_NAMES[folder] = name
+    SOURCE_PATTERNS[folder] = spec.patterns
+    return spec
+
+
+def method_spec(method):
+    '''
+    Spec of a method given by name or data folder. Raises KeyError if it is not registered.
+    '''
+    if method in METHODS:
+        return METHODS[method]
+    for spec in METHODS.values():
+        if spec.name == method:
+            return spec
+    raise KeyError(f'Method {method} is not registered.')
+
+
+def default_folders():
+    return [folder for folder in DATA_FOLDERS if METHODS[folder].default]
+
+
+def method_folders(methods=None):
+    '''
+    Data folders of methods given by name or folder, in the order of the registry (None
+    selects the methods of the default view). Unknown methods are ignored.
+    '''
+    if methods is None:
+        return default_folders()
+    return [folder for folder in DATA_FOLDERS if folder in methods or METHOD_NAMES[folder] in methods]
+
+
+def load_experimental(pathdir, units):
+    '''
+    Converts the experimental table to Hartree in one pass and splits it by element
+    '''
+    data = expapp.experimentalData(pathdir, units)
+    table = data.dat_table.set_index('Element')
+    orbs = table.columns
+    ener = table.to_numpy(dtype=np.float64) * misc.conversion_factor(units, 'Hartree')
+    ener = pd.DataFrame(ener, index=table.index, columns=orbs)
+    ener.columns.name = 'Orbital'
+    refs = data.ref_table.set_index('Element')[orbs]
+    energies = {symbol: row.dropna().rename(None) for symbol, row in ener.iterrows()}
+    references = {symbol: refs.loc[symbol, row.index].rename(None) for symbol, row in energies.items()}
+    return energies, references
+
+
+def load_theoretical(pathdir, units):
+    '''
+    Keeps the energy column of each atom as a float64 serie in Hartree
+    '''
+    data = theoapp.theoreticalData(pathdir, units)
+    energies = dict()
+    for atom, df in data.bindener_data.items():
+        if df is None:
+            continue
+        input_units = misc.determine_energy_units(df.columns)
+        ener = df[misc.column_name(input_units)].astype(np.float64)
+        energies[atom] = misc.convert_energy(ener, input_units, 'Hartree').rename(None)
+    return energies, dict()
+
+
+register_method('experimental', 'Experimental', load_experimental, ['ElectronBindingEnergies*.tsv'],
+                units='eV', orbitals='nlj', marker='circle-open')
+register_method('perturbative', 'Relativistic', load_theoretical, ['*/bindener.dat'],
+                units='Hartree', orbitals='nlj', marker='square-open')
+register_method('dirac-fock', 'Dirac-Fock', load_theoretical, ['ElectronBindingEnergies.tsv'],
+                units='Hartree', orbitals='nlj', marker='diamond-open')
+register_method('hartree-fock', 'Hartree-Fock', load_theoretical, ['*/bindener.dat'],
+                units='Hartree', orbitals='nl', marker='triangle-up-open')
+# in-house calculations, read only when selected
+register_method('semi-relativistic', 'Semi-relativistic', load_theoretical, ['*/bindener.dat'],
+                units='Hartree', orbitals='nl', marker='cross-open', default=False)
+register_method('mcdhf', 'MCDHF', load_theoretical, ['*/bindener.dat'],
+                units='Hartree', orbitals='nlj', marker='star-open', default=False)
@@ -0,0 +1,244 @@
+"""
+
+Module with the timing spans of the hot paths, aggregated into histograms and exposed with
+the cache statistics and the memory of the store in the Prometheus text format:
+
+    @metrics.timed('assembly')            # every call of the function
+    with metrics.span('figure'): ...      # a block
+
+    GET /metrics                          # route added by metrics.register(server)
+
+Metrics are kept per process: with several server workers each scrape reads one of them.
+
+Slow requests can be profiled by setting BINDENER_PROFILE_SLOW_MS (threshold in ms):
+every request is then run under cProfile, and the stats of those slower than the
+threshold are written to BINDENER_PROFILE_DIR (./profiles/ by default), to be read with
+pstats or snakeviz.
+
+"""
+import os
+import re
+import time
+import bisect
+import cProfile
+import functools
+import threading
+import contextlib
+from src.lazy_imports import lazy_import
+
+# only needed by the server hooks, so that the data modules can be timed without Flask
+flask = lazy_import('flask')
+
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class histogram:
+    '''
+    Histogram of durations (s) per label value, e.g. stage="assembly"
+    '''
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = dict()
+        self.lock = threading.Lock()
+
+
+    def observe(self, value, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            counts = self.series.get(value)
+            if counts is None:
+                counts = self.series[value] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += seconds
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self.series.items()}
+        for value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{escape(value)}"'
+            cumulative = 0
+            for le, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                le = '+Inf' if le == float('inf') else repr(le)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total!r}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+STAGE_SECONDS = histogram('bindener_stage_seconds', 'Time spent in each stage of loading, assembly and figure building.', 'stage')
+CALLBACK_SECONDS = histogram('bindener_callback_seconds', 'Time spent in each Dash callback.', 'callback')
+REQUEST_SECONDS = histogram('bindener_request_seconds', 'Time spent serving each endpoint of the server.', 'endpoint')
+
+# cache name -> function returning the info() dictionary of the cache (hits, misses, size)
+caches = dict()
+# gauge name -> (help, function returning {labels: value}), see register_gauge
+gauges = dict()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextlib.contextmanager
+def span(stage, hist=STAGE_SECONDS):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(stage, time.perf_counter() - t0)
+
+
+def timed(stage, hist=STAGE_SECONDS):
+    '''
+    Decorator recording the duration of every call of a function under stage
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                hist.observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
+def timed_callback(func):
+    '''
+    Decorator recording the duration of a Dash callback under its name
+    '''
+    return timed(func.__name__, CALLBACK_SECONDS)(func)
+
+
+def register_cache(name, info):
+    caches[name] = info
+
+
+def register_gauge(name, help, values):
+    '''
+    Adds a gauge computed at every scrape: values() returns {((label, value), ...): number}
+    '''
+    gauges[name] = (help, values)
+
+
+def render_caches():
+    stats = dict()
+    for name, info in caches.items():
+        try:
+            stats[name] = info()
+        except Exception:
+            continue
+    lines = []
+    for metric, key, kind, help in [
+            ('bindener_cache_hits_total', 'hits', 'counter', 'Cache hits.'),
+            ('bindener_cache_misses_total', 'misses', 'counter', 'Cache misses.'),
+            ('bindener_cache_hit_ratio', 'hit_rate', 'gauge', 'Fraction of cache lookups that were hits.'),
+            ('bindener_cache_entries', 'size', 'gauge', 'Entries in cache.')]:
+        lines += [f'# HELP {metric} {help}', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{cache="{escape(name)}"}} {float(info[key])!r}' for name, info in sorted(stats.items())]
+    return lines
+
+
+def render_gauges():
+    lines = []
+    for name, (help, values) in sorted(gauges.items()):
+        try:
+            current = values()
+        except Exception:
+            continue
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+        for labels, value in sorted(current.items()):
+            labels = ','.join(f'{key}="{escape(val)}"' for key, val in labels)
+            lines.append(f'{name}{{{labels}}} {float(value)!r}' if labels else f'{name} {float(value)!r}')
+    return lines
+
+
+def render():
+    '''
+    Every metric in the Prometheus text format
+    '''
+    lines = []
+    for hist in [STAGE_SECONDS, CALLBACK_SECONDS, REQUEST_SECONDS]:
+        lines += hist.render()
+    lines += render_caches() + render_gauges()
+    return '\n'.join(lines) + '\n'
+
+
+def profile_threshold():
+    '''
+    Threshold (s) of the requests to profile, None if profiling is off
+    '''
+    threshold = os.environ.get('BINDENER_PROFILE_SLOW_MS')
+    return float(threshold) / 1e3 if threshold else None
+
+
+def before_request():
+    flask.g.metrics_start = time.perf_counter()
+    if profile_threshold() is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            return
+        flask.g.profiler = profiler
+
+
+def after_request(response):
+    '''
+    Records the request once its response is closed, so the duration (and the profile) of
+    streamed responses covers the generation of the whole body
+    '''
+    start = flask.g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = flask.request.endpoint or 'unknown'
+    path = flask.request.path
+    profiler = flask.g.pop('profiler', None)
+
+    def record():
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(endpoint, elapsed)
+        if profiler is not None:
+            profiler.disable()
+            threshold = profile_threshold()
+            if threshold is not None and elapsed >= threshold:
+                dump_profile(profiler, elapsed, path)
+
+    response.call_on_close(record)
+    return response
+
+
+def dump_profile(profiler, elapsed, path):
+    folder = os.environ.get('BINDENER_PROFILE_DIR', './profiles')
+    path = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or 'root'
+    fname = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{path}-{1e3 * elapsed:.0f}ms.prof'
+    try:
+        os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(os.path.join(folder, fname))
+    except OSError:
+        pass
+
+
+def metrics_route():
+    return flask.Response(render(), content_type=CONTENT_TYPE)
+
+
+def register(server):
+    '''
+    Adds the /metrics route and the request timing (and profiling) hooks to a Flask server
+    '''
+    server.add_url_rule('/metrics', 'metrics', metrics_route)
+    server.before_request(before_request)
+    server.after_request(after_request)
+    return server
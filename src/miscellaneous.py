@@ -7,7 +7,13 @@ Module with miscellaneous functions used in experimental and perturbative module
 import os
 import numpy as np
 import re
+import functools
 import pandas as pd
+from src.lazy_imports import lazy_import
+
+# only used by some functions, imported on first use
+constants = lazy_import('scipy.constants')
+periodictable = lazy_import('periodictable')
 
 
 def print_title(title):
@@ -26,6 +32,8 @@ def isNaN(value):
         return np.isnan(value).any()
     elif isinstance(value, pd.Series):
         return value.isnull().values.any()
+    elif isinstance(value, np.ndarray):
+        return np.isnan(value).any()
 
 def column_name(units):
     '''
@@ -45,64 +53,71 @@ def convert_energy_units(df, input_units, units):
     '''
     Convert binding energy values from default to given by user
     '''
-    # convert data from eV to units
     def_colname = column_name(input_units)
     colname = column_name(units)
-    ener = df[def_colname]
-    if input_units == 'eV':
-        df[colname] = convert_energy_from_eV(ener, units)
-    # convert data from Rydbergs to units
-    elif input_units == 'Rydberg':
-        df[colname] = convert_energy_from_Rydberg(ener, units)
-    # convert data from Hartree to units
-    elif input_units == 'Hartree':
-        df[colname] = convert_energy_from_Hartree(ener, units)
+    df[colname] = convert_energy(df[def_colname], input_units, units)
     return df
 
 # energy conversion 
 
 def physical_constants(constant_name):
-    from scipy.constants import physical_constants
-    return physical_constants[constant_name]
+    return constants.physical_constants[constant_name]
+
+# factors to convert one Hartree to each unit. Hartree energy in eV of CODATA 2022, as in
+# scipy.constants, written here to avoid importing scipy at startup
+HARTREE_TO_EV = 27.211386245981
+ENERGY_UNITS_PER_HARTREE = {
+    'Hartree': 1.0,
+    'Rydberg': 2.0,
+    'eV': HARTREE_TO_EV}
+
+def conversion_factor(input_units, units):
+    '''
+    Factor to multiply energies given in input_units to obtain them in units
+    '''
+    return ENERGY_UNITS_PER_HARTREE[units] / ENERGY_UNITS_PER_HARTREE[input_units]
+
+def convert_energy(ener, input_units, units):
+    '''
+    Convert energy (float, list, array or serie) from input_units to units with a single 
+    multiplication. NaN values are passed through.
+    '''
+    if isinstance(ener, list): 
+        ener = np.asarray(ener, dtype=np.float64)
+    return ener * conversion_factor(input_units, units)
+
+def round_significant(values, digits=12):
+    '''
+    Rounds values (float, array or serie) to digits significant figures, removing the noise
+    of unit conversions, e.g. 12100 eV stored in Hartree comes back as 12100 instead of
+    12099.999999999998. NaN and zero values are passed through.
+    '''
+    array = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(array)))
+    scale = 10.0 ** np.where(np.isfinite(magnitude), digits - 1 - magnitude, 0)
+    rounded = np.round(array * scale) / scale
+    if isinstance(values, pd.Series):
+        return pd.Series(rounded, index=values.index, name=values.name)
+    return rounded
 
 def convert_energy_from_eV(ener, units):
     ''' Convert energy units from eV to Hartree or Rydberg '''
-    conv_hartree_to_eV = physical_constants('Hartree energy in eV')[0]
-    conv = None
-    conv_ener = None
-    if units=='eV': conv = 1.0
-    if units=='Hartree': conv = conv_hartree_to_eV
-    if units=='Rydberg': conv = conv_hartree_to_eV/2.0
-    if not isNaN(ener): conv_ener = ener/conv # esto solo funciona para float, cuando uso una serie, tengo que usar .any()
-    return conv_ener
+    return convert_energy(ener, 'eV', units)
 
 
 def convert_energy_from_Rydberg(ener, units):
     '''
     Convert energy units from Rydberg to Hartree or eV
     '''
-    conv_hartree_to_eV = physical_constants('Hartree energy in eV')[0]
-    conv = None
-    conv_ener = None
-    if units=='eV': conv = 0.50*conv_hartree_to_eV
-    if units=='Hartree': conv = 0.50
-    if units=='Rydberg': conv = 1.0
-    if not isNaN(ener): conv_ener = ener*conv
-    return conv_ener
+    return convert_energy(ener, 'Rydberg', units)
 
 
 def convert_energy_from_Hartree(ener, units):
     '''
     Convert energy units from Hartree to Rydberg or eV
     '''
-    conv_hartree_to_eV = physical_constants('Hartree energy in eV')[0]
-    conv = None
-    conv_ener = None
-    if units=='eV': conv = conv_hartree_to_eV
-    if units=='Hartree': conv = 1.0
-    if units=='Rydberg': conv = 2.0
-    if not isNaN(ener): conv_ener = ener*conv
-    return conv_ener
+    return convert_energy(ener, 'Hartree', units)
 
 
 def shorten_units(units):
@@ -129,8 +144,9 @@ def percent_relative_error(experiment, calculation):
     return abs_relative_error(experiment, calculation)*100
 
 def mean_value(df_column):
-    x = df_column.dropna()
-    return sum(abs(x))/len(x)
+    ''' Mean of the absolute values, ignoring NaN '''
+    x = np.abs(np.asarray(df_column, dtype=np.float64))
+    return np.nanmean(x)
 
 # check stuff 
 
@@ -147,9 +163,79 @@ def check_folder_exists(folder):
 
 # other functions
 
+class elementIndex:
+    '''
+    Index of the elements of the periodic table, built once from the periodictable module
+    the first time ELEMENTS is used.
+    Arrays are indexed by atomic number Z (position 0 is unused):
+
+        symbols[Z], names[Z], density[Z] (g/cm^3, NaN if unknown), mass[Z] (g/mol)
+
+    Elements can be given as symbols or names in any case, or as atomic numbers.
+    '''
+
+    def __init__(self):
+        elements = [el for el in periodictable.elements if el.number > 0]
+        zmax = max(el.number for el in elements)
+        self.symbols = np.full(zmax + 1, '', dtype=object)
+        self.names = np.full(zmax + 1, '', dtype=object)
+        self.density = np.full(zmax + 1, np.nan)
+        self.mass = np.full(zmax + 1, np.nan)
+        for el in elements:
+            self.symbols[el.number] = el.symbol
+            self.names[el.number] = el.name
+            self.density[el.number] = el.density if el.density is not None else np.nan
+            self.mass[el.number] = el.mass if el.mass is not None else np.nan
+        self.symbol_numbers = {el.symbol: el.number for el in elements}
+        self.numbers = {key.lower(): el.number for el in elements for key in (el.symbol, el.name, str(el.number))}
+        self.zmax = zmax
+
+
+    def atomic_number(self, element):
+        '''
+        Atomic number of element (symbol, name or number). Raises KeyError if unknown.
+        '''
+        if isinstance(element, (int, np.integer)):
+            if 0 < element <= self.zmax:
+                return int(element)
+        elif isinstance(element, str):
+            number = self.numbers.get(element.strip().lower())
+            if number is not None:
+                return number
+        raise KeyError(f'Unknown element {element!r}.')
+
+
+    def atomic_numbers(self, elements):
+        return np.array([self.atomic_number(el) for el in elements], dtype=int)
+
+
+    def symbol(self, element):
+        return self.symbols[self.atomic_number(element)]
+
+
+    def is_symbol(self, symbol):
+        '''
+        Whether symbol is exactly the symbol of an element (case-sensitive)
+        '''
+        return symbol in self.symbol_numbers
+
+
+@functools.lru_cache(maxsize=None)
+def element_index():
+    return elementIndex()
+
+
+def __getattr__(name):
+    # ELEMENTS is built on first access, so importing this module does not import periodictable
+    if name == 'ELEMENTS':
+        return element_index()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 def periodic_table(element_str):
     ''' 
-    Inherits periodic table properties given by periodictable module 
+    Inherits periodic table properties given by periodictable module. Elements are found
+    with ELEMENTS (symbols, names or numbers); returns None for unknown ones.
 
     Example: 
     >> periodic_table('He').name
@@ -158,10 +244,24 @@ def periodic_table(element_str):
     2
     
     '''
-    import periodictable
-    for el in periodictable.elements:
-        if el.symbol == element_str: 
-            return el
+    try:
+        return periodictable.elements[element_index().atomic_number(element_str)]
+    except KeyError:
+        return None
+
+def fermi_gas_parameters(ne, density, mass):
+    ''' 
+    Wigner-Seitz radius (a.u.) and Fermi energy (Hartree) of a free electron gas with ne 
+    electrons per atom, given the density (g/cm^3) and atomic mass of the element
+    '''
+    C = 0.5 * (9 * np.pi / 4) ** (2/3)
+    # atomic density in atomic units
+    atomic_den = (8.916E-2 * float(ne) * density / mass)
+    # wigner-seitz radii
+    rs = (3 / (4 * np.pi * atomic_den)) ** (1/3)
+    # fermi energy
+    Ef_hartree = C / rs ** 2
+    return rs, Ef_hartree
 
 def FEG_params(ne, at_density, at_weight):
     ''' 
@@ -0,0 +1,89 @@
+"""
+
+Module with the canonical index of atomic orbitals shared by all the databases
+
+Relativistic orbitals (nlj) are labelled with a sign for j = l -/+ 1/2, e.g. 2p- and 2p+,
+and non-relativistic ones (nl) without it, e.g. 2p. Every nlj orbital gets an integer code
+following the canonical order: by n, then l, then j (2p-, 2p+).
+
+"""
+import numpy as np
+import pandas as pd
+
+
+L_SYMBOLS = 'spdfg'
+MAX_N = 8
+
+
+def build_orbital_table():
+    '''
+    Table of nlj orbitals in canonical order, indexed by code, with the integer quantum
+    numbers n, l and 2j and the label of the nl orbital each one belongs to
+    '''
+    rows = []
+    for n in range(1, MAX_N + 1):
+        for l in range(min(n, len(L_SYMBOLS))):
+            nl = f'{n}{L_SYMBOLS[l]}'
+            if l == 0:
+                rows.append((nl, n, l, 1, nl))
+            else:
+                rows.append((nl + '-', n, l, 2 * l - 1, nl))
+                rows.append((nl + '+', n, l, 2 * l + 1, nl))
+    table = pd.DataFrame(rows, columns=['label', 'n', 'l', 'j2', 'nl'])
+    table.index.name = 'code'
+    return table
+
+
+ORBITALS = build_orbital_table()
+LABELS = ORBITALS['label'].to_numpy()
+
+# label (nl or nlj) -> codes of the nlj orbitals it covers, e.g. '2p' -> [2, 3], '2p-' -> [2]
+EXPANSION = {label: np.array([code]) for code, label in enumerate(LABELS)}
+for nl, codes in ORBITALS.groupby('nl').groups.items():
+    EXPANSION.setdefault(nl, np.asarray(codes))
+
+
+def orbital_codes(labels):
+    '''
+    Canonical codes of nlj labels. Raises KeyError for nl labels of l > 0.
+    '''
+    codes = [EXPANSION[label] for label in labels]
+    if any(len(code) != 1 for code in codes):
+        raise KeyError('orbital_codes expects relativistic (nlj) labels.')
+    return np.array([code[0] for code in codes], dtype=int)
+
+
+def orbital_labels(codes):
+    return LABELS[np.asarray(codes, dtype=int)]
+
+
+def orbital_sort_key(label):
+    '''
+    Position of label (nl or nlj) in the canonical order; unknown labels go last
+    '''
+    return int(EXPANSION[label][0]) if label in EXPANSION else len(LABELS)
+
+
+def sort_orbitals(labels):
+    return sorted(labels, key=orbital_sort_key)
+
+
+def expand_to_nlj(series):
+    '''
+    Re-indexes a serie given by orbital labels (nl or nlj) with nlj codes. Values of nl
+    orbitals are repeated for both j, e.g. the value of 2p is used for 2p- and 2p+.
+    '''
+    codes = [EXPANSION[label] for label in series.index]
+    counts = np.array([len(code) for code in codes], dtype=int)
+    index = np.concatenate(codes) if codes else np.array([], dtype=int)
+    return pd.Series(np.repeat(series.to_numpy(), counts), index=index)
+
+
+def merge_methods(data, orbital_codes):
+    '''
+    Builds a table of orbital_codes x methods from the dictionary data = {method: serie}
+    with series indexed by nl or nlj labels, using integer re-indexing only
+    '''
+    columns = {method: expand_to_nlj(serie).reindex(orbital_codes).to_numpy() for method, serie in data.items()}
+    index = pd.Index(orbital_labels(orbital_codes), name='Orbital')
+    return pd.DataFrame(columns, index=index)
@@ -0,0 +1,225 @@
+"""
+
+Module with the HTTP endpoints returning binding energies as JSON or CSV, registered on the
+Flask server of the app:
+
+    GET /api/bindener/<symbol>?units=eV&methods=Experimental,Hartree-Fock&orbitals=4f-,4f+
+    GET /api/bindener?elements=Au,W,79&units=eV&format=csv
+    GET /api/export?elements=W&methods=Experimental,Relativistic&units=eV&format=parquet
+
+Parameters accept comma separated or repeated values, and any of them left out selects
+everything. Responses carry a strong ETag derived from the data version and the query, so
+conditional requests (If-None-Match) get 304 while the data does not change. Bodies are
+gzip-compressed when the client accepts it, and bulk responses of more than STREAM_ROWS
+rows are streamed. Exports (energies, relative errors and references as a file to
+download) are always streamed.
+
+"""
+import json
+import zlib
+import hashlib
+import flask
+import src.miscellaneous as misc
+import src.data_store as store
+import src.method_registry as registry
+import src.caching as caching
+import src.orbital_index as orbidx
+import src.error_engine as errors
+import src.export_data as export
+
+
+FORMATS = {'json': 'application/json', 'csv': 'text/csv; charset=utf-8'}
+STREAM_ROWS = 5000
+CHUNK_ROWS = 2000
+
+blueprint = flask.Blueprint('bindener_api', __name__, url_prefix='/api')
+
+# encoded bodies of the responses not streamed, keyed on their ETag
+responses_cache = caching.lruCache(maxsize=256)
+
+
+class queryError(ValueError):
+    pass
+
+
+def split_values(name):
+    '''
+    Values of a query parameter given as repeated and/or comma separated values (None if absent)
+    '''
+    values = [v.strip() for arg in flask.request.args.getlist(name) for v in arg.split(',') if v.strip()]
+    return values or None
+
+
+def parse_query(data_store, elements=None, formats=FORMATS):
+    '''
+    Reads and validates the query parameters. Returns the arguments of bindenerStore.query
+    and the output format.
+    '''
+    units = flask.request.args.get('units', 'Hartree')
+    if units not in misc.ENERGY_UNITS_PER_HARTREE:
+        raise queryError(f'units must be one of {list(misc.ENERGY_UNITS_PER_HARTREE)}.')
+    fmt = flask.request.args.get('format', 'json').lower()
+    if fmt not in formats:
+        raise queryError(f'format must be one of {list(formats)}.')
+
+    if elements is not None:
+        known = set(data_store.table['Z'].unique().tolist())
+        parsed = [misc.ELEMENTS.numbers.get(el.lower()) for el in elements]
+        unknown = [el for el, z in zip(elements, parsed) if z not in known]
+        if unknown:
+            raise queryError(f'no data for elements {unknown}.')
+        elements = parsed
+
+    methods = split_values('methods')
+    if methods is not None:
+        names = set(store.METHOD_NAMES) | set(store.METHOD_NAMES.values())
+        unknown = [m for m in methods if m not in names]
+        if unknown:
+            raise queryError(f'unknown methods {unknown}, use any of {list(store.METHOD_NAMES.values())}.')
+        available = data_store.available_methods()
+        unavailable = [m for m in methods if registry.method_spec(m).folder not in available]
+        if unavailable:
+            raise queryError(f'no data for methods {unavailable}.')
+
+    orbitals = split_values('orbitals')
+    if orbitals is not None:
+        unknown = [orb for orb in orbitals if orb not in orbidx.EXPANSION]
+        if unknown:
+            raise queryError(f'unknown orbitals {unknown}.')
+
+    return {'elements': elements, 'orbitals': orbitals, 'methods': methods, 'units': units}, fmt
+
+
+def entity_tag(data_version, query, fmt):
+    '''
+    Strong ETag of the (uncompressed) representation of a query for a data version. The
+    hash of the code is part of the key, so the tag changes when the encoding changes.
+    '''
+    key = json.dumps([data_version, caching.code_version(caching.CODE_FOLDER), query, fmt], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:24]
+
+
+def accepts_gzip():
+    return flask.request.accept_encodings['gzip'] > 0
+
+
+def not_modified(etag):
+    '''
+    Whether If-None-Match matches etag, with or without the suffix of the gzip variant
+    '''
+    if_none_match = flask.request.if_none_match
+    return if_none_match.contains(etag) or if_none_match.contains(etag + '-gzip') or if_none_match.star_tag
+
+
+def encode_chunks(df, fmt, units, data_version):
+    '''
+    Yields the encoded body of a query result in chunks of CHUNK_ROWS rows
+    '''
+    if fmt == 'csv':
+        for start in range(0, max(len(df), 1), CHUNK_ROWS):
+            yield df.iloc[start:start + CHUNK_ROWS].to_csv(index=False, header=start == 0).encode()
+        return
+
+    df = df.rename(columns={misc.column_name(units): 'Energy'})
+    yield f'{{"version": "{data_version}", "units": "{units}", "columns": {json.dumps(list(df.columns))}, "data": ['.encode()
+    for start in range(0, len(df), CHUNK_ROWS):
+        # floats are written with their shortest repr, NaN as null
+        rows = json.dumps(export.json_values(df.iloc[start:start + CHUNK_ROWS]))
+        yield ((', ' if start > 0 else '') + rows[1:-1]).encode()
+    yield b']}'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def energies_response(elements=None):
+    '''
+    Response of a query of the process-wide store, 304 if the client has the current version
+    '''
+    data_store = store.get_store()
+    data_store.refresh_if_stale()
+    try:
+        query, fmt = parse_query(data_store, elements)
+    except queryError as error:
+        return flask.jsonify({'error': str(error)}), 400
+
+    data_version = data_store.data_version
+    etag = entity_tag(data_version, query, fmt)
+    gzip = accepts_gzip()
+    headers = {
+        'ETag': f'"{etag}-gzip"' if gzip else f'"{etag}"',
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'}
+    if not_modified(etag):
+        return flask.Response(status=304, headers=headers)
+
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    body = responses_cache.get((etag, gzip))
+    if body is None:
+        try:
+            df = data_store.query(**query)
+        except KeyError as error:
+            return flask.jsonify({'error': error.args[0]}), 400
+        chunks = encode_chunks(df, fmt, query['units'], data_version)
+        if len(df) > STREAM_ROWS:
+            if gzip:
+                chunks = gzip_chunks(chunks)
+            return flask.Response(flask.stream_with_context(chunks), mimetype=FORMATS[fmt], headers=headers)
+        body = b''.join(chunks)
+        if gzip:
+            body = zlib.compress(body, 6, wbits=31)
+        responses_cache.put((etag, gzip), body)
+    return flask.Response(body, mimetype=FORMATS[fmt], headers=headers)
+
+
+@blueprint.route('/bindener/<symbol>')
+def element_energies(symbol):
+    return energies_response([symbol])
+
+
+@blueprint.route('/bindener')
+def bulk_energies():
+    return energies_response(split_values('elements'))
+
+
+@blueprint.route('/export')
+def export_energies():
+    '''
+    Streams the export of elements (all by default) as a file to download
+    '''
+    data_store = store.get_store()
+    data_store.refresh_if_stale()
+    elements = split_values('elements')
+    try:
+        query, fmt = parse_query(data_store, elements, export.EXPORT_FORMATS)
+        if fmt == 'parquet' and not export.parquet_available():
+            raise queryError('parquet export needs pyarrow.')
+    except queryError as error:
+        return flask.jsonify({'error': str(error)}), 400
+
+    etag = entity_tag(data_store.data_version, dict(query, orbitals=None, export=True), fmt)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': 'no-cache',
+        'Content-Disposition': f'attachment; filename="{export.export_filename(fmt, elements, query["units"])}"'}
+    if not_modified(etag):
+        return flask.Response(status=304, headers=headers)
+
+    engine = errors.get_error_engine(methods=query['methods'])
+    chunks = export.export_chunks(engine, fmt, query['elements'], query['methods'], query['units'])
+    return flask.Response(flask.stream_with_context(chunks), mimetype=export.EXPORT_FORMATS[fmt], headers=headers)
+
+
+def register(server):
+    '''
+    Adds the endpoints to a Flask server, e.g. register(app.server)
+    '''
+    server.register_blueprint(blueprint)
+    return server
@@ -1,211 +1,425 @@
 import pandas as pd
 import src.miscellaneous as misc
-import plotly.express as px
-import plotly.graph_objects as go
 import numpy as np
-import src.miscellaneous as misc
 import os
-import src.experimental_enerdata as expapp
-import src.theoretical_enerdata as theoapp
-
-
-
+import copy
+import functools
+import src.data_store as store
+import src.method_registry as registry
+import src.caching as caching
+import src.wavefunctions as wave
+import src.orbital_index as orbidx
+import src.metrics as metrics
+from src.lazy_imports import lazy_import
+
+# only needed to build go.Figure objects, the app sends plain dictionaries
+go = lazy_import('plotly.graph_objects')
+
+
+# assembled bindingEnergies objects, keyed on (datafolder, atom, units, data version, methods)
+bindener_cache = caching.lruCache(maxsize=int(os.environ.get('BINDENER_CACHE_SIZE', 32)))
+
+
+def get_binding_energies(atom_symbol, units, datafolder='./data/', methods=None):
+    '''
+    Returns the bindingEnergies object of atom_symbol in units with methods (those of the
+    default view if None), reusing a cached one when the data did not change. The returned
+    object is a shallow copy, so setting attributes like fermi_energy does not affect other
+    callers.
+    '''
+    atom_symbol = misc.ELEMENTS.symbol(atom_symbol)
+    data_store = store.get_store(datafolder)
+    data_store.refresh_if_stale()
+    folders = tuple(registry.method_folders(methods))
+    key = (data_store.main_folder, atom_symbol, units, data_store.data_version, folders)
+    # one hit or miss is counted per call: a hit if the atom does not need to be assembled
+    bindener = bindener_cache.peek(key)
+    if bindener is None:
+        # other units of an already assembled atom only need a rescaling
+        canonical_key = key[:2] + ('Hartree',) + key[3:]
+        canonical = bindener_cache.peek(canonical_key) if units != 'Hartree' else None
+        bindener_cache.record(canonical is not None)
+        if canonical is None:
+            canonical = bindingEnergies(atom_symbol=atom_symbol, units='Hartree', datafolder=datafolder,
+                                        data_store=data_store, methods=folders)
+            bindener_cache.put(canonical_key, canonical)
+        bindener = canonical.convert_units(units)
+        bindener_cache.put(key, bindener)
+    else:
+        bindener_cache.record(True)
+    return copy.copy(bindener)
+
+
+def configure_cache(maxsize):
+    '''
+    Changes the number of bindingEnergies objects kept in cache
+    '''
+    bindener_cache.resize(maxsize)
+
+
+# static part of the layout of the binding energies figure
+BINDENER_LAYOUT = {
+    'xaxis': {
+        'title': {'text': "Orbitals"},
+        'ticks': "inside",
+        'showgrid': True},
+    'yaxis': {
+        'type': 'log',
+        # yaxis with minor ticks (workaround), tickvals and ticktext are set per figure
+        'automargin': False,
+        'ticks': "inside",
+        'showgrid': True},
+    'legend': {
+        'title': {'text': ""},
+        'yanchor': "top",
+        'y': 0.99,
+        'xanchor': "left",
+        'x': 0.8},
+    'hovermode': "x unified",
+    'plot_bgcolor': 'white'}
+
+
+@functools.lru_cache(maxsize=None)
+def figure_template():
+    '''
+    Plotly 'simple_white' template as a dictionary, resolved once. Figures get a copy of it,
+    as the cached dictionary must not be modified.
+    '''
+    import plotly.io as pio
+    return pio.templates['simple_white'].to_plotly_json()
+
+
+def log_decade_range(values):
+    '''
+    Decades (imin, imax) of the log axis covering the positive values of an array, series or
+    dataframe of any shape. Non-positive and NaN values (e.g. Eu 4f at the Fermi level) are
+    not shown on a log axis. Returns None if there are no positive values.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    positive = values[values > 0]
+    if positive.size == 0:
+        return None
+    vmin, vmax = positive.min(), positive.max()
+
+    imin = int(np.log10(vmin).round())
+    imin = imin if 10.0 ** imin < vmin else imin - 1
+    imax = int(np.log10(vmax).round())
+    imax = imax if 10.0 ** imax > vmax else imax + 1
+    return imin, imax
+
+
+@functools.lru_cache(maxsize=256)
+def decade_ticks(decade_min, decade_max):
+    '''
+    Tick values of a log axis from 10^decade_min to 10^(decade_max + 1): every integer
+    multiple of each decade, with a label only at the powers of ten. Results are shared
+    between calls, so they are returned as tuples.
+    '''
+    decades = np.arange(decade_min, decade_max + 1)
+    tickvals = (np.arange(1, 10) * 10.0 ** decades[:, None]).ravel()
+    ticktext = np.full((len(decades), 9), '', dtype=object)
+    ticktext[:, 0] = [f"{10.0 ** i:.0e}" for i in decades]
+    return tuple(tickvals.tolist()), tuple(ticktext.ravel().tolist())
+
+
+def log_minor_and_major_ticks(values):
+    '''
+    Tick values and labels of a log axis covering the positive values in values (array,
+    series or dataframe)
+    '''
+    decades = log_decade_range(values)
+    if decades is None:
+        return (), ()
+    return decade_ticks(*decades)
+
+
+@metrics.timed('wavefunction_graph')
+def wavefunction_figure(atom_symbol, orbitals=None, data_folder='perturbative', field='P', max_points=wave.MAX_TRACE_POINTS, datafolder='./data/'):
+    '''
+    Figure with field (P, Q or rho) of the radial wavefunctions of orbitals (all those of
+    atom_symbol in data_folder if None), read straight from the wavefunction index. Each
+    trace is downsampled to max_points on the server.
+    '''
+    waves = wave.get_wavefunctions(datafolder)
+    if orbitals is None: orbitals = waves.available_orbitals(data_folder, atom_symbol)
+
+    fig = go.Figure()
+    radii = []
+    for orbital in orbitals:
+        trace = waves.downsampled_wave(data_folder, atom_symbol, orbital, field, max_points)
+        if trace is None:
+            continue
+        radii.append(trace[0][[0, -1]])
+        fig.add_trace(
+            go.Scatter(
+                x = trace[0],
+                y = trace[1],
+                mode = 'lines',
+                name = orbital)
+        )
+
+    labels = {'P': 'P(r)', 'Q': 'Q(r)', 'rho': 'rho(r)'}
+    fig.update_layout(
+        title = f"Radial wavefunctions for {atom_symbol}",
+        xaxis_title = "r (a.u.)",
+        yaxis_title = labels.get(field, field),
+        legend_title = f"",
+        template = 'simple_white',
+        hovermode = "x unified")
+    tickvals, ticktext = log_minor_and_major_ticks(radii)
+    fig.update_xaxes(type='log', ticks="inside", showgrid=True, tickvals=tickvals, ticktext=ticktext)
+    fig.update_yaxes(ticks="inside", showgrid=True)
+
+    return fig
+
+
+def none_if_nan(value):
+    return None if np.isnan(value) else float(value)
 
 
 class bindingEnergies:
 
-    def __init__(self, atom_symbol=None, units=None, datafolder='./data/'):
-        self.atom_symbol = atom_symbol
-        self.atom = misc.periodic_table(self.atom_symbol)
-        self.units = units
+    @metrics.timed('assembly')
+    def __init__(self, atom_symbol=None, units=None, datafolder='./data/', data_store=None, methods=None):
+        self.atomic_number = misc.ELEMENTS.atomic_number(atom_symbol)
+        self.atom_symbol = misc.ELEMENTS.symbols[self.atomic_number]
+        self.atom = misc.periodic_table(self.atomic_number)
+        self.units = units if units is not None else 'Hartree'
         self.main_folder = datafolder
-        self.experiment = self.pull_bindener_data('experimental')
-        self.relativistic = self.pull_bindener_data('perturbative')
-        self.diracfock = self.pull_bindener_data('dirac-fock')
-        # self.semirelat = self.pull_bindener_data('semi-relativistic')
-        self.hartreefock = self.pull_bindener_data('hartree-fock')
-        self.bindener = self.arrange_data_to_dataframe(units)
+        self.store = data_store if data_store is not None else store.get_store(datafolder)
+        # only the methods requested (those of the default view if None) are loaded
+        self.data_folders = registry.method_folders(methods)
+        self.store.load_methods(self.data_folders)
+        self.method_data = {store.METHOD_NAMES[folder]: self.pull_bindener_data(folder) for folder in self.data_folders}
+        # energies are assembled in Hartree and rescaled to the units requested
+        self.bindener_hartree = self.arrange_data_to_dataframe('Hartree')
+        self.bindener = self.bindener_hartree * misc.conversion_factor('Hartree', self.units)
         self.orbitals = self.bindener.index
         self.methods = self.bindener.columns
         self.fermi_energy = None
         self.bindener_error = self.compute_relative_errors()
 
+    def convert_units(self, units):
+        '''
+        Returns a shallow copy of the object with binding energies in units. Relative 
+        errors do not depend on units and are shared.
+        '''
+        bindener = copy.copy(self)
+        bindener.units = units
+        bindener.bindener = self.bindener_hartree * misc.conversion_factor('Hartree', units)
+        bindener.fermi_energy = None
+        return bindener
+
+    def to_dict(self):
+        '''
+        JSON-serializable copy of the atom data with energies in Hartree (None for NaN)
+        '''
+        energies = self.bindener_hartree.astype(object).where(self.bindener_hartree.notna(), None)
+        return {
+            'atom': self.atom_symbol,
+            'number': self.atomic_number,
+            'density': none_if_nan(misc.ELEMENTS.density[self.atomic_number]),
+            'mass': none_if_nan(misc.ELEMENTS.mass[self.atomic_number]),
+            'orbitals': list(self.orbitals),
+            'methods': list(self.methods),
+            'energies': {method: energies[method].tolist() for method in self.methods}}
+
+    @classmethod
+    def from_dict(cls, data, units):
+        '''
+        Rebuilds the energies of an atom from to_dict in units, without reading the store.
+        Only the figure methods (binding_energies_figure, fermi_line, compute_FEG_parameters)
+        can be used on the returned object.
+        '''
+        bindener = cls.__new__(cls)
+        bindener.atomic_number = data['number']
+        bindener.atom_symbol = data['atom']
+        bindener.units = units
+        bindener.main_folder = None
+        bindener.store = None
+        index = pd.Index(data['orbitals'], name='Orbital')
+        energies = {method: pd.Series(values, index=index, dtype=np.float64) for method, values in data['energies'].items()}
+        bindener.bindener_hartree = pd.DataFrame(energies, index=index, columns=data['methods'], dtype=np.float64)
+        bindener.bindener = bindener.bindener_hartree * misc.conversion_factor('Hartree', units)
+        bindener.orbitals = bindener.bindener.index
+        bindener.methods = bindener.bindener.columns
+        bindener.fermi_energy = None
+        bindener.bindener_error = None
+        return bindener
+
+    @metrics.timed('pull_bindener_data')
     def pull_bindener_data(self, data_folder):
 
         try:
-            pathdir = os.path.join(self.main_folder, data_folder)
-            if data_folder == 'experimental':
-                atom_df = expapp.experimentalData(pathdir, self.units).element_binding_energies(self.atom_symbol)
-            else:
-                atom_df = theoapp.theoreticalData(pathdir, self.units).element_binding_energies(self.atom_symbol)
+            atom_df = self.store.element_binding_energies(data_folder, self.atom_symbol, 'Hartree')
         except:
             atom_df = None
 
         return atom_df
 
     def arrange_data_to_dict(self):
-        input = {
-            'Experimental': self.experiment,
-            'Relativistic': self.relativistic,
-            'Dirac-Fock': self.diracfock,
-            # 'Semi-relativistic': self.semirelat,
-            'Hartree-Fock': self.hartreefock}
-        return {key: value for key, value in input.items() if value is not None}
+        return {key: value for key, value in self.method_data.items() if value is not None}
 
 
     def get_orbitals(self, bindener_dict):
-        orbs = None
-        methods = list(bindener_dict.keys())
-        if len(methods) == 1 and 'Experimental' in methods:
-            orbs = bindener_dict['Experimental'].index
-        if 'Relativistic' in methods:
-            orbs = bindener_dict['Relativistic'].index
-        elif 'Dirac-Fock' in methods:
-            orbs = bindener_dict['Dirac-Fock'].index
-        return orbs
-
-
+        '''
+        Canonical codes (sorted) of the orbitals shown: those of the first calculation with
+        nlj orbitals (Relativistic, then Dirac-Fock, ...), or all the orbitals with data if
+        none is available. Empty if the atom has no data.
+        '''
+        calculations = [method for method in bindener_dict if registry.method_spec(method).orbitals == 'nlj'
+                        and registry.method_spec(method).folder != registry.REFERENCE_METHOD]
+        if calculations:
+            orbs = bindener_dict[calculations[0]].index
+        else:
+            orbs = [orb for data in bindener_dict.values() for orb in data.index]
+        if len(orbs) == 0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate([orbidx.EXPANSION[orb] for orb in orbs]))
+
+
+    @metrics.timed('arrange_data_to_dataframe')
     def arrange_data_to_dataframe(self, units):
         bindener_dict = self.arrange_data_to_dict()
         orbs = self.get_orbitals(bindener_dict)
-        bindener = pd.DataFrame(index=orbs)
-        for method in bindener_dict.keys():
-            data = bindener_dict[method]
+        energies = dict()
+        for method, data in bindener_dict.items():
             col_ener = [col for col in data.columns if units in col][0]
-            if method in ['Experimental', 'Relativistic']:
-                data = pd.DataFrame({method: data[col_ener]}, index=data.index)
-            else:
-                data = self.arrange_nonrelat_energies(data, col_ener, orbs, method)
-            bindener = bindener.join(data)
+            energies[method] = data[col_ener]
+        # non-relativistic (nl) energies are expanded to both j by the orbital index
+        bindener = orbidx.merge_methods(energies, orbs)
         bindener = bindener.dropna(axis=0, how='all')
         return bindener
 
 
-    def arrange_nonrelat_energies(self, df, col, orbs, method):
-        nonrelat_orbs = df.index
-        ener_arr = dict()
-        for nlm in orbs:
-            match = [nl for nl in nonrelat_orbs if (nlm[:-1] == nl) or (nlm == nl)]
-            if match: 
-                ener_arr[nlm] = df[col][match[0]]
-        df_arr = pd.DataFrame.from_dict(ener_arr, orient='index', columns=[method])
-        return df_arr
-
-
+    @metrics.timed('relative_errors')
     def compute_relative_errors(self):
         methods = self.methods
         relat_err = pd.DataFrame(index=self.orbitals)
         if 'Experimental' in methods:
-            exp = self.bindener['Experimental']
+            # all methods at once; experimental zeros (at the Fermi level) give no error
+            exp = self.bindener['Experimental'].replace(0.0, np.nan)
             methods = methods.drop('Experimental')
-            for method in methods:
-                relat_err[method] = (exp - self.bindener[method]) / exp
+            relat_err = self.bindener[methods].rsub(exp, axis=0).div(exp, axis=0)
         return relat_err
 
 
     def compute_FEG_parameters(self, ne):
-        ne = float(ne)
-        C = 0.5 * (9 * np.pi / 4) ** (2/3)
-        density = self.atom.density # units: g/cm^3
-        mass = self.atom.mass # units (g)
-        # atomic density in atomic units
-        atomic_den = (8.916E-2 * ne * density / mass)
-        # wigner-seitz radii
-        rs = (3 / (4 * np.pi * atomic_den)) ** (1/3)
-        # fermi energy
-        Ef_hartree = C / rs ** 2
+        density = misc.ELEMENTS.density[self.atomic_number] # units: g/cm^3
+        mass = misc.ELEMENTS.mass[self.atomic_number] # units (g)
+        rs, Ef_hartree = misc.fermi_gas_parameters(ne, density, mass)
         # convert units
         Ef_units = misc.convert_energy_from_Hartree(Ef_hartree, self.units)
         self.fermi_energy = Ef_units
         return rs, Ef_units
 
 
-    def log_minor_and_major_ticks(self, df):
+    def wave_orbitals(self, data_folder='perturbative'):
+        '''
+        Orbitals with radial wavefunction available for the atom in data_folder
+        '''
+        return wave.get_wavefunctions(self.main_folder).available_orbitals(data_folder, self.atom_symbol)
+
 
-        vmin = min([min(df[col]) for col in df.columns])
-        imin = np.log10(vmin).round()
-        imin = imin if 1 * 10 ** imin < vmin else imin - 1
+    def radial_wavefunction(self, orbital, data_folder='perturbative'):
+        '''
+        Radial wavefunction of orbital as a structured array with fields r, P (and Q, rho
+        for relativistic orbitals). Files are read on demand and memory-mapped.
+        '''
+        return wave.get_wavefunctions(self.main_folder).load_wavefunction(data_folder, self.atom_symbol, orbital)
 
-        vmax = max([max(df[col]) for col in df.columns])
-        imax = np.log10(vmax).round()
-        imax = imax if 1 * 10 ** imax > vmax else imax + 1
 
-        nexp = np.arange(imin, imax + 1, 1)
-        og_ticksvals = [1 * 10 ** i for i in nexp]
-        nw_ticksvals = [el for i in nexp for el in np.arange(1 * 10 ** i, 1 * 10 ** (i + 1), 1 * 10 ** i)]
-        tickstext = [f"{val:.0e}" if val in og_ticksvals else "" for val in nw_ticksvals]
+    def radial_table(self, data_folder='perturbative'):
+        '''
+        Binding energies of the method in data_folder next to the radial expectation values
+        (norm, <r>, <r^2>, <1/r> and radius of maximum density, in a.u.) of its orbitals
+        '''
+        expectations = wave.get_wavefunctions(self.main_folder).expectation_values()
+        try:
+            table = expectations.loc[(data_folder, self.atom_symbol)]
+        except KeyError:
+            table = pd.DataFrame(columns=wave.EXPECTATION_COLUMNS, dtype=np.float64)
+        try:
+            energies = self.store.element_binding_energies(data_folder, self.atom_symbol, self.units)
+        except KeyError:
+            energies = None
+        return energies.join(table, how='left') if energies is not None else table
 
-        return nw_ticksvals, tickstext
 
+    def wavefunction_graph(self, orbitals=None, data_folder='perturbative', field='P', max_points=wave.MAX_TRACE_POINTS):
+        '''
+        Figure with field (P, Q or rho) of the radial wavefunctions of orbitals, see
+        wavefunction_figure
+        '''
+        return wavefunction_figure(self.atom_symbol, orbitals, data_folder, field, max_points, self.main_folder)
 
-    def binding_energies_graph(self, orbitals=None, methods=None):
 
+    def log_minor_and_major_ticks(self, df):
+        return log_minor_and_major_ticks(df)
+
+
+    def fermi_line(self, orbitals, visible=True):
+        '''
+        Dashed horizontal line at the Fermi energy spanning orbitals (trace dictionary), empty
+        if there are no orbitals
+        '''
+        x = list(orbitals)[:1] + list(orbitals)[-1:]
+        return {
+            'type': 'scatter',
+            'x': x,
+            'y': [self.fermi_energy] * len(x),
+            'mode': 'lines',
+            'line': {'color': 'grey', 'width': 1.5, 'dash': 'dash'},
+            'hovertemplate': '%{y:.3f} ' + misc.shorten_units(self.units),
+            'showlegend': False,
+            'visible': visible}
+
+
+    @metrics.timed('binding_energies_figure')
+    def binding_energies_figure(self, orbitals=None, methods=None):
+        '''
+        Figure of the binding energies as a plain dictionary (data and layout), built directly
+        from the energy arrays on top of the prebuilt layout of BINDENER_LAYOUT
+        '''
         if orbitals is None: orbitals = self.orbitals
         if methods is None: methods = self.methods
 
-        markers = ['circle-open', 'square-open', 'diamond-open', 'triangle-up-open', 'cross-open']
-        dmarkers = dict(zip(methods, markers))
-
-        fig = px.scatter(
-            self.bindener, 
-            x = orbitals, 
-            y = methods, 
-            log_y = True, 
-            template = 'simple_white')
+        units_short = misc.shorten_units(self.units)
+        hovertemplate = '%{y:.3f} ' + units_short
+        energies = self.bindener.reindex(index=orbitals)
+        x = list(orbitals)
+        data = [
+            {
+                'type': 'scatter',
+                'mode': 'markers',
+                'name': method,
+                'legendgroup': method,
+                'x': x,
+                'y': energies[method].to_numpy(),
+                'marker': {'symbol': registry.method_spec(method).marker, 'line': {'width': 1.5}},
+                'hovertemplate': hovertemplate
+            }
+            for method in methods]
 
         if self.fermi_energy:
-            fig.add_trace(
-                go.Scatter(
-                    x = [orbitals[0], orbitals[-1]],
-                    y = [self.fermi_energy, self.fermi_energy],
-                    mode = "lines",
-                    line = dict(color='grey', width=1.5, dash='dash'),
-                    showlegend = False)
-            )
-
-        for i, marker in enumerate(dmarkers.values()):
-            fig['data'][i]['marker']['symbol'] = marker
-
-        fig.update_layout(
-            title = f"Binding energies for {self.atom_symbol}",
-            xaxis_title = "Orbitals",
-            yaxis_title = f"Binding energies ({misc.shorten_units(self.units)})",
-            legend_title = f"",
-            hovermode = "x unified",
-            plot_bgcolor = 'white',
-            legend = dict(
-                yanchor = "top",
-                y = 0.99,
-                xanchor = "left",
-                x = 0.8
-                )
-            )
-
-        fig.update_xaxes(
-            # tickvals = [0] + list(orbitals) + [1],
-            # ticktext = [''] + list(orbitals) + ['']
-            ticks="inside",
-            showgrid=True
-            )
+            data.append(self.fermi_line(orbitals))
 
         nw_ticksvals, tickstext = self.log_minor_and_major_ticks(self.bindener)
-        fig.update_yaxes(
-            type = 'log',
-            # # yaxis with minor ticks (workaround)
+        # deep copies, so that changes to the figure do not leak into other figures
+        layout = copy.deepcopy(BINDENER_LAYOUT)
+        layout['template'] = copy.deepcopy(figure_template())
+        layout['title'] = {'text': f"Binding energies for {self.atom_symbol}"}
+        layout['yaxis'] = dict(layout['yaxis'],
+            title = {'text': f"Binding energies ({units_short})"},
             tickvals = nw_ticksvals,
-            ticktext = tickstext,
-            automargin = False,
-            ticks = "inside",
-            # # yaxis without minor yticks
-            # dtick=1,
-            # tickformat = "e",
-            showgrid=True)
-
-        fig.update_traces(
-            marker = dict(line=dict(width=1.5)),
-            hovertemplate = '%{y:.3f} ' + misc.shorten_units(self.units))
-
-        return fig
+            ticktext = tickstext)
+
+        return {'data': data, 'layout': layout}
+
+
+    @metrics.timed('binding_energies_graph')
+    def binding_energies_graph(self, orbitals=None, methods=None):
+        return go.Figure(self.binding_energies_figure(orbitals=orbitals, methods=methods))
 
 
     def plot_binding_energies(self):
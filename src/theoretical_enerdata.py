@@ -46,7 +46,7 @@ class theoreticalData:
             # list atoms with theoretical data
             for root, dirs, files in os.walk(self.folder):
                 if root == self.folder:
-                    atoms = [atom for atom in dirs if misc.periodic_table(atom)]
+                    atoms = [atom for atom in dirs if misc.ELEMENTS.is_symbol(atom)]
                     break
 
             # load binding energy theoretical data
@@ -0,0 +1,298 @@
+"""
+
+Module for indexing and reading the radial wavefunctions stored in the waves/ folders
+
+"""
+import os
+import re
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import src.caching as caching
+import src.orbital_index as orbidx
+import src.metrics as metrics
+
+
+WAVE_FOLDERS = ['perturbative', 'hartree-fock']
+WAVE_FILE_REGEX = re.compile(r'^wave(\d+[a-z][+-]?)\.dat$')
+
+# binary copies of the wave files, written inside the main data folder
+CACHE_FOLDERNAME = '.wavecache'
+EXPECTATION_FILENAME = 'expectation_values.npz'
+
+# step in ln(r) of the shared grid, finer than the grids of the wave files (1/32 and 1/16)
+LOG_GRID_STEP = 1.0 / 64
+EXPECTATION_COLUMNS = ['Norm', '<r>', '<r^2>', '<1/r>', 'r_max']
+
+# points kept per plotted trace. The wave files have 160-200 (hartree-fock) and 265-420
+# (perturbative) points, so every trace is reduced; 150 points still resolve the nodes of
+# the outer orbitals on the logarithmic axis.
+MAX_TRACE_POINTS = 150
+
+
+class wavefunctionData:
+    '''
+    Index of the radial wavefunctions available per method (data folder) and atom.
+
+    Files are only listed when the index is built. Each orbital is read the first time it
+    is requested and kept as a structured array with fields named after the file header
+    (r, P for non-relativistic orbitals and r, P, Q, rho for relativistic ones). Loaded
+    orbitals are cached as .npy files and memory-mapped on later reads.
+    '''
+
+    def __init__(self, datafolder='./data/', cache_folder=None):
+        self.main_folder = datafolder
+        self.cache_folder = cache_folder if cache_folder is not None else os.path.join(datafolder, CACHE_FOLDERNAME)
+        self.lock = threading.RLock()
+        self.loaded = dict()
+        self.expectations = None
+        self.traces = caching.lruCache(maxsize=2048)
+        self.index = self.index_waves()
+
+
+    def index_waves(self):
+        '''
+        Lists the wave files of every atom: index[data_folder][atom][orbital] = file path
+        '''
+        index = dict()
+        for data_folder in WAVE_FOLDERS:
+            pathdir = os.path.join(self.main_folder, data_folder)
+            if not os.path.isdir(pathdir):
+                continue
+            index[data_folder] = dict()
+            for atom in sorted(os.listdir(pathdir)):
+                wavedir = os.path.join(pathdir, atom, 'waves')
+                if not os.path.isdir(wavedir):
+                    continue
+                orbitals = dict()
+                for fname in os.listdir(wavedir):
+                    match = WAVE_FILE_REGEX.match(fname)
+                    if match:
+                        orbitals[match.group(1)] = os.path.join(wavedir, fname)
+                index[data_folder][atom] = {orb: orbitals[orb] for orb in orbidx.sort_orbitals(orbitals)}
+        return index
+
+
+    def available_atoms(self, data_folder):
+        return list(self.index.get(data_folder, dict()).keys())
+
+
+    def available_orbitals(self, data_folder, atom):
+        '''
+        Returns the orbitals with wavefunction of atom in data_folder ([] if there are none)
+        '''
+        return list(self.index.get(data_folder, dict()).get(atom, dict()).keys())
+
+
+    def load_wavefunction(self, data_folder, atom, orbital):
+        '''
+        Returns the radial wavefunction of orbital as a read-only structured array, e.g.
+        wave['r'], wave['P']. Raises KeyError if the orbital has no wave file.
+        '''
+        key = (data_folder, atom, orbital)
+        wave = self.loaded.get(key)
+        if wave is None:
+            fpath = self.index[data_folder][atom][orbital]
+            wave = self.read_cached_wave(data_folder, atom, orbital, fpath)
+            with self.lock:
+                self.loaded[key] = wave
+        return wave
+
+
+    def downsampled_wave(self, data_folder, atom, orbital, field, max_points=MAX_TRACE_POINTS):
+        '''
+        Returns (r, values) of field ('P', 'Q' or 'rho') reduced to at most max_points with
+        LTTB on the logarithmic grid. Reduced traces are cached. Returns None if the orbital
+        has no such field (e.g. Q for non-relativistic orbitals).
+        '''
+        key = (data_folder, atom, orbital, field, max_points)
+        trace = self.traces.get(key)
+        if trace is None:
+            wave = self.load_wavefunction(data_folder, atom, orbital)
+            if field == 'rho':
+                values = radial_density(wave)
+            elif field in wave.dtype.names:
+                values = wave[field]
+            else:
+                return None
+            idx = downsample_lttb(np.log(wave['r']), values, max_points)
+            trace = (np.asarray(wave['r'][idx]), np.asarray(values[idx]))
+            self.traces.put(key, trace)
+        return trace
+
+
+    def cache_filepath(self, data_folder, atom, orbital):
+        return os.path.join(self.cache_folder, data_folder, atom, f'wave{orbital}.npy')
+
+
+    @metrics.timed('read_wave')
+    def read_cached_wave(self, data_folder, atom, orbital, fpath):
+        '''
+        Memory-maps the binary copy of fpath, (re)writing it when missing or older than fpath
+        '''
+        cache_path = self.cache_filepath(data_folder, atom, orbital)
+        if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(fpath):
+            return np.load(cache_path, mmap_mode='r')
+        wave = read_wave_file(fpath)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, wave)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # read-only data folder: keep the parsed copy in memory
+            wave.flags.writeable = False
+            return wave
+        return np.load(cache_path, mmap_mode='r')
+
+
+    def index_version(self):
+        '''
+        Hash of the path, size and modification time of every indexed wave file
+        '''
+        md5 = hashlib.md5()
+        for data_folder, atoms in self.index.items():
+            for atom, orbitals in atoms.items():
+                for orbital, fpath in orbitals.items():
+                    stat = os.stat(fpath)
+                    md5.update(f'{data_folder}/{atom}/{orbital}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return md5.hexdigest()[:16]
+
+
+    def expectation_values(self):
+        '''
+        Radial expectation values of every indexed orbital as a dataframe indexed (and
+        sorted) by (data folder, atom, orbital) with the columns in EXPECTATION_COLUMNS. They are
+        computed once and saved in the cache folder next to the wave copies.
+        '''
+        if self.expectations is None:
+            with self.lock:
+                if self.expectations is None:
+                    self.expectations = self.load_expectation_values()
+        return self.expectations
+
+
+    @metrics.timed('expectation_values')
+    def load_expectation_values(self):
+        version = self.index_version()
+        cache_path = os.path.join(self.cache_folder, EXPECTATION_FILENAME)
+        if os.path.isfile(cache_path):
+            with np.load(cache_path, allow_pickle=False) as cached:
+                if str(cached['version']) == version:
+                    index = pd.MultiIndex.from_arrays(list(cached['keys'].T), names=['Method', 'Atom', 'Orbital'])
+                    return sort_expectation_values(pd.DataFrame(cached['values'], index=index, columns=EXPECTATION_COLUMNS))
+
+        keys = [(data_folder, atom, orbital) for data_folder, atoms in self.index.items()
+                for atom, orbitals in atoms.items() for orbital in orbitals]
+        waves = [self.load_wavefunction(*key) for key in keys]
+        r, density = stack_on_log_grid(waves)
+        values = radial_expectation_values(r, density)
+        try:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, version=np.array(version), keys=np.array(keys, dtype=str), values=values)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        index = pd.MultiIndex.from_tuples(keys, names=['Method', 'Atom', 'Orbital'])
+        return sort_expectation_values(pd.DataFrame(values, index=index, columns=EXPECTATION_COLUMNS))
+
+
+def sort_expectation_values(df):
+    '''
+    Sorts the expectation values by method and atom, and orbitals in their canonical order
+    '''
+    return df.sort_index(key=lambda level: level.map(orbidx.orbital_sort_key) if level.name == 'Orbital' else level)
+
+
+def radial_density(wave):
+    '''
+    Radial density of a wavefunction: rho = P^2 + Q^2 (P^2 for non-relativistic orbitals)
+    '''
+    names = wave.dtype.names
+    if 'rho' in names:
+        return wave['rho']
+    if 'Q' in names:
+        return wave['P'] ** 2 + wave['Q'] ** 2
+    return wave['P'] ** 2
+
+
+def stack_on_log_grid(waves, step=LOG_GRID_STEP):
+    '''
+    Interpolates the radial densities of all waves on a shared logarithmic grid covering 
+    every wave grid. Returns the grid and a (waves x grid points) density matrix, with 
+    zeros outside each wave grid.
+    '''
+    lnr_min = min(np.log(w['r'][0]) for w in waves)
+    lnr_max = max(np.log(w['r'][-1]) for w in waves)
+    lnr = np.arange(lnr_min, lnr_max + step, step)
+    density = np.zeros((len(waves), len(lnr)))
+    for i, w in enumerate(waves):
+        density[i] = np.interp(lnr, np.log(w['r']), radial_density(w), left=0.0, right=0.0)
+    return np.exp(lnr), density
+
+
+def radial_expectation_values(r, density):
+    '''
+    Integrates all the densities at once with the trapezoidal rule in ln(r) (dr = r dln(r)).
+    Returns a (waves x 5) array with the norm, <r>, <r^2>, <1/r> (normalized by the norm)
+    and the radius of maximum density.
+    '''
+    weights = r * np.log(r[1] / r[0])
+    weights[[0, -1]] *= 0.5
+    powers = np.column_stack([np.ones_like(r), r, r ** 2, 1.0 / r])
+    moments = density @ (powers * weights[:, None])
+    norm = moments[:, :1]
+    r_max = r[np.argmax(density, axis=1)]
+    return np.column_stack([norm, moments[:, 1:] / norm, r_max])
+
+
+def downsample_lttb(x, y, n_out):
+    '''
+    Largest-Triangle-Three-Buckets downsampling: returns the indices of n_out points of
+    (x, y) that keep the visual shape of the curve (first and last points included)
+    '''
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def read_wave_file(fpath):
+    '''
+    Reads a tab separated wave file with a header line into a structured array
+    '''
+    with open(fpath) as f:
+        names = f.readline().split()
+        values = np.loadtxt(f, dtype=np.float64, ndmin=2)
+    return np.rec.fromarrays(values.T, names=names).view(np.ndarray)
+
+
+_waves = dict()
+_waves_lock = threading.Lock()
+
+
+def get_wavefunctions(datafolder='./data/'):
+    '''
+    Returns the process-wide wavefunction index for datafolder, building it the first time
+    '''
+    key = os.path.abspath(datafolder)
+    with _waves_lock:
+        if key not in _waves:
+            _waves[key] = wavefunctionData(datafolder)
+    return _waves[key]
@@ -0,0 +1,23 @@
+import src.caching as caching
+
+
+def test_memoize_key_follows_code(tmp_path):
+    module = tmp_path / 'module.py'
+    module.write_text('VERSION = 1\n')
+    first = caching.code_version(str(module))
+    module.write_text('VERSION = 2\n')
+    caching.code_version.cache_clear()
+    assert caching.code_version(str(module)) != first
+
+
+def test_memoize():
+    calls = []
+    cache = caching.lruCache(maxsize=8)
+
+    @caching.memoize(cache, version=lambda: 'v1')
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square(3) == 9 and square(3) == 9
+    assert calls == [3]
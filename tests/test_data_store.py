@@ -0,0 +1,21 @@
+import sys
+import subprocess
+import pytest
+import src.data_store as store
+
+
+def test_query_returns_source_values():
+    df = store.query_binding_energies(['W'], ['2s', '3d-'], ['Experimental'], 'eV')
+    assert df['Energy(eV)'].tolist() == [12100.0, 1949.0]
+    assert df.to_csv(index=False).splitlines()[1] == '74,W,2s,Experimental,12100.0,[1]'
+
+
+def test_method_without_data_is_not_loaded():
+    with pytest.raises(KeyError):
+        store.query_binding_energies(['W'], methods=['MCDHF'])
+    assert 'mcdhf' not in store.get_store().loaded
+
+
+def test_element_index_is_built_on_first_use():
+    script = 'import sys, src.data_store; assert "periodictable" not in sys.modules'
+    subprocess.run([sys.executable, '-c', script], check=True)
@@ -0,0 +1,19 @@
+import os
+import shutil
+import pandas as pd
+import src.experimental_enerdata as expapp
+
+
+def test_outdated_tables_in_read_only_folder(tmp_path, monkeypatch):
+    shutil.copy('data/experimental/ElectronBindingEnergies.tsv', tmp_path)
+    expapp.experimentalData(str(tmp_path), 'eV')
+    raw_path = tmp_path / 'ElectronBindingEnergies.tsv'
+    os.utime(raw_path, (os.path.getmtime(raw_path) + 10,) * 2)
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('read-only file system')
+    monkeypatch.setattr(pd.DataFrame, 'to_csv', read_only)
+    data = expapp.experimentalData(str(tmp_path), 'eV')
+    assert data.dat_table.set_index('Element').loc['W', '2s'] == 12100.0
+    assert sorted(os.listdir(tmp_path)) == ['ElectronBindingEnergies.tsv', 'ElectronBindingEnergies_dat.tsv',
+                                            'ElectronBindingEnergies_ref.tsv']
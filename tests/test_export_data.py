@@ -0,0 +1,23 @@
+import io
+import json
+import pandas as pd
+import src.error_engine as errors
+import src.export_data as export
+
+
+def test_export_returns_source_values():
+    engine = errors.get_error_engine()
+    chunks = export.export_chunks(engine, 'csv', ['W'], ['Experimental'], 'eV')
+    table = pd.read_csv(io.BytesIO(b''.join(chunks))).set_index('Orbital')
+    assert table.loc['2s', 'Experimental (eV)'] == 12100
+    assert table.loc['3d-', 'Experimental (eV)'] == 1949
+
+
+def test_json_export_matches_csv():
+    engine = errors.get_error_engine()
+    methods = ['Experimental', 'Hartree-Fock']
+    csv = pd.read_csv(io.BytesIO(b''.join(export.export_chunks(engine, 'csv', ['W'], methods, 'eV'))))
+    records = json.loads(b''.join(export.export_chunks(engine, 'json', ['W'], methods, 'eV')))
+    assert records[1]['Experimental (eV)'] == 12100.0
+    error = csv['Hartree-Fock rel. error'].dropna().iloc[0]
+    assert repr(float(error)) in b''.join(export.export_chunks(engine, 'json', ['W'], methods, 'eV')).decode()
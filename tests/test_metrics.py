@@ -0,0 +1,22 @@
+import time
+import flask
+import src.metrics as metrics
+
+
+def test_streamed_response_is_timed_to_the_end():
+    app = metrics.register(flask.Flask(__name__))
+
+    @app.route('/slow-stream')
+    def slow_stream():
+        def generate():
+            yield 'a'
+            time.sleep(0.05)
+            yield 'b'
+        return flask.Response(flask.stream_with_context(generate()))
+
+    with app.test_client() as client:
+        response = client.get('/slow-stream')
+        assert response.get_data(as_text=True) == 'ab'
+        response.close()
+    counts, total = metrics.REQUEST_SECONDS.series['slow_stream']
+    assert sum(counts) == 1 and total >= 0.05
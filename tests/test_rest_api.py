@@ -0,0 +1,27 @@
+import flask
+import pytest
+import src.rest_api as api
+
+
+@pytest.fixture
+def client():
+    return api.register(flask.Flask(__name__)).test_client()
+
+
+def test_json_floats_use_shortest_repr(client):
+    body = client.get('/api/bindener/W?units=eV&methods=Experimental,Hartree-Fock&orbitals=2s').get_data(as_text=True)
+    assert '[74, "W", "2s", "Experimental", 12100.0, "[1]"]' in body
+    assert '10706.5593787, null]' in body
+
+
+def test_method_without_data_is_rejected(client):
+    response = client.get('/api/bindener/W?methods=MCDHF')
+    assert response.status_code == 400
+    assert 'MCDHF' in response.get_json()['error']
+
+
+def test_entity_tag_changes_with_code(monkeypatch):
+    query = {'elements': ['W'], 'orbitals': None, 'methods': None, 'units': 'eV'}
+    etag = api.entity_tag('version', query, 'json')
+    monkeypatch.setattr(api.caching, 'code_version', lambda *paths: 'other code')
+    assert api.entity_tag('version', query, 'json') != etag
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+import src.structure_data as struc
+
+
+@pytest.mark.parametrize('atom', ['Np', 'Og'])
+def test_element_without_data(atom):
+    bindener = struc.get_binding_energies(atom, 'eV')
+    assert bindener.bindener.empty
+    assert bindener.to_dict()['methods'] == []
+    assert bindener.fermi_line(bindener.orbitals)['x'] == []
+
+
+def test_method_without_data():
+    bindener = struc.get_binding_energies('W', 'eV', methods=['mcdhf'])
+    assert bindener.bindener.empty
+    assert bindener.binding_energies_figure()['data'] == []
+
+
+def test_figure_layout_is_not_shared():
+    layout = struc.get_binding_energies('W', 'eV').binding_energies_figure()['layout']
+    layout['xaxis']['title']['text'] = 'changed'
+    layout['template']['layout']['font'] = {'size': 40}
+    assert struc.BINDENER_LAYOUT['xaxis']['title']['text'] == 'Orbitals'
+    other = struc.get_binding_energies('Au', 'eV').binding_energies_figure()['layout']
+    assert other['template']['layout']['font'] != {'size': 40}
+    assert other['template'] is not layout['template']
+
+
+def test_figure_from_store_data():
+    bindener = struc.get_binding_energies('W', 'eV')
+    rebuilt = struc.bindingEnergies.from_dict(bindener.to_dict(), 'eV')
+    figure, expected = rebuilt.binding_energies_figure(), bindener.binding_energies_figure()
+    assert [trace['x'] for trace in figure['data']] == [trace['x'] for trace in expected['data']]
+    assert all(np.allclose(a['y'], b['y'], equal_nan=True) for a, b in zip(figure['data'], expected['data']))
+    assert figure['layout']['yaxis'] == expected['layout']['yaxis']
+
+
+def test_cache_counts_one_lookup_per_call():
+    struc.bindener_cache.clear()
+    struc.get_binding_energies('W', 'eV')
+    struc.get_binding_energies('W', 'Rydberg')
+    info = struc.bindener_cache.info()
+    assert (info['hits'], info['misses']) == (1, 1)
@@ -0,0 +1,31 @@
+import numpy as np
+import src.wavefunctions as wave
+import src.structure_data as struc
+import src.orbital_index as orbidx
+
+
+def test_lttb_keeps_shape_of_long_wave():
+    # synthetic wave with several nodes, far longer than the trace budget
+    lnr = np.linspace(np.log(1e-5), np.log(50), 20000)
+    y = np.exp(-np.exp(lnr) / 4) * np.sin(3 * lnr) * np.exp(lnr / 3)
+    idx = wave.downsample_lttb(lnr, y, wave.MAX_TRACE_POINTS)
+    assert len(idx) == wave.MAX_TRACE_POINTS
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert np.all(np.diff(idx) > 0)
+    resampled = np.interp(lnr, lnr[idx], y[idx])
+    assert np.max(np.abs(resampled - y)) < 0.02 * np.max(np.abs(y))
+
+
+def test_plotted_traces_are_downsampled():
+    waves = wave.get_wavefunctions()
+    orbital = waves.available_orbitals('perturbative', 'W')[0]
+    fig = struc.wavefunction_figure('W', [orbital], 'perturbative', 'P')
+    assert len(waves.load_wavefunction('perturbative', 'W', orbital)) > wave.MAX_TRACE_POINTS
+    assert len(fig.data[0].x) == wave.MAX_TRACE_POINTS
+
+
+def test_expectation_values_in_canonical_orbital_order():
+    values = wave.get_wavefunctions().expectation_values()
+    orbitals = values.loc[('perturbative', 'W')].index.tolist()
+    assert orbitals == orbidx.sort_orbitals(orbitals)
+    assert orbitals[:4] == ['1s', '2s', '2p-', '2p+']
@@ -0,0 +1,12 @@
+"""
+
+WSGI entry point for production servers. Importing it loads all the databases, so with a
+pre-fork server they are read once and shared by the workers, e.g.
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+"""
+from bindener_app import server
+
+
+application = server